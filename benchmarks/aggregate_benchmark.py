@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+"""
+Compares the pure Python and NumPy backends of tappio.aggregate.
+
+The entry tables are filled with random rows directly, as generating and
+parsing ledgers of millions of entries would dominate the run time.
+
+Usage: aggregate_benchmark.py [number of entries ...]
+"""
+
+import random
+import sys
+
+from array import array
+from datetime import date
+
+from ledger import best_of
+
+from tappio import aggregate
+from tappio.columns import EntryTable
+
+
+def random_table(num_entries, num_accounts=150, days=3650, seed=0):
+    rng = random.Random(seed)
+    begin = date(2010, 1, 1).toordinal()
+
+    table = EntryTable()
+    table.event_indices = array("q", range(num_entries))
+    table.date_ordinals = array("l", sorted(begin + rng.randrange(days) for i in range(num_entries)))
+    table.account_numbers = array("q", (1000 + rng.randrange(num_accounts) for i in range(num_entries)))
+    table.cents = array("q", (rng.randint(-100000, 100000) for i in range(num_entries)))
+    table.num_events = num_entries
+    return table
+
+
+def main():
+    if aggregate.numpy is None:
+        print("NumPy is not installed")
+        return
+
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10 ** 5, 10 ** 6, 10 ** 7]
+    before = date(2015, 1, 1)
+
+    for size in sizes:
+        table = random_table(size)
+
+        operations = [
+            ("sum_by_account", aggregate.python_sum_by_account, aggregate.numpy_sum_by_account, ()),
+            ("sum_by_account(before)", aggregate.python_sum_by_account, aggregate.numpy_sum_by_account, (before,)),
+            ("sum_by_account_and_month", aggregate.python_sum_by_account_and_month,
+                aggregate.numpy_sum_by_account_and_month, ()),
+        ]
+
+        print("{0} entries".format(size))
+        for name, python_func, numpy_func, args in operations:
+            assert python_func(table, *args) == numpy_func(table, *args)
+            python_time = best_of(lambda: python_func(table, *args))
+            numpy_time = best_of(lambda: numpy_func(table, *args))
+            print("  {0:<26} python {1:8.3f} s  numpy {2:8.3f} s {3:6.1f}x".format(
+                name, python_time, numpy_time, python_time / numpy_time))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Synthetic ledgers for the benchmarks.
+"""
+
+import random
+
+from datetime import date, timedelta
+from io import StringIO
+
+from tappio.models import Document, Account, Event, Entry
+from tappio.writer import Writer
+
+
+def generate_accounts(accounts_per_tree=50):
+    def tree(name, first_number):
+        return Account(None, name, [
+            Account(first_number + i, "Tili {0}".format(first_number + i))
+            for i in range(accounts_per_tree)
+        ])
+
+    return [
+        tree("Vastaavaa", 1000),
+        tree("Vastattavaa", 2000),
+        tree("Tulos", 3000),
+    ]
+
+
+def account_numbers(accounts):
+    numbers = []
+    for tree in accounts:
+        numbers.extend(account.number for account in tree.subaccounts)
+    return numbers
+
+
+def generate_events(num_events, numbers, entries_per_event=4, begin=date(2010, 1, 1),
+        days=365, descriptions=500, seed=0):
+    rng = random.Random(seed)
+    texts = ["Tapahtuma {0}".format(i) for i in range(descriptions)]
+
+    for number in range(1, num_events + 1):
+        entries = [Entry(rng.choice(numbers), rng.randint(-100000, 100000))
+            for i in range(entries_per_event - 1)]
+        entries.append(Entry(rng.choice(numbers), -sum(entry.cents for entry in entries)))
+
+        event_date = begin + timedelta(days=days * (number - 1) // num_events)
+        yield Event(number, event_date, rng.choice(texts), entries)
+
+
+def generate_document(num_events, entries_per_event=4, seed=0):
+    accounts = generate_accounts()
+    events = list(generate_events(num_events, account_numbers(accounts),
+        entries_per_event=entries_per_event, seed=seed))
+
+    return Document(name="Synthetic", begin=date(2010, 1, 1), end=date(2010, 12, 31),
+        accounts=accounts, events=events)
+
+
+def generate_tlk(num_events, entries_per_event=4, seed=0, **kwargs):
+    sio = StringIO()
+    Writer(sio, **kwargs).write_document(generate_document(num_events, entries_per_event, seed))
+    return sio.getvalue()
+
+
+def best_of(func, repeat=3):
+    from time import perf_counter
+
+    best = None
+    for i in range(repeat):
+        start = perf_counter()
+        func()
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+"""
+Reports the memory used per event by a loaded document.
+
+"Before" rebuilds the document the way it was represented before the
+models had __slots__: ordinary objects, and a new date, description and
+account number object for every event and entry.
+
+Usage: memory_benchmark.py [number of events]
+"""
+
+import sys
+import tracemalloc
+
+from datetime import date
+
+from ledger import generate_tlk
+
+from tappio import loadb
+from tappio.lexer import ENCODING
+
+
+class PlainEvent(object):
+    def __init__(self, number, date, description, entries):
+        self.number = number
+        self.date = date
+        self.description = description
+        self.entries = entries
+
+
+class PlainEntry(object):
+    def __init__(self, account_number, cents):
+        self.account_number = account_number
+        self.cents = cents
+
+
+def fresh(value):
+    return int(str(value))
+
+
+def plain_events(events):
+    return [
+        PlainEvent(
+            fresh(event.number),
+            date(event.date.year, event.date.month, event.date.day),
+            event.description.encode(ENCODING).decode(ENCODING),
+            [PlainEntry(fresh(entry.account_number), fresh(entry.cents)) for entry in event.entries],
+        )
+        for event in events
+    ]
+
+
+def measure(func):
+    tracemalloc.start()
+    result = func()
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, size
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    data = generate_tlk(size).encode(ENCODING)
+
+    document, after = measure(lambda: loadb(data))
+    events, before = measure(lambda: plain_events(document.events))
+
+    print("{0} events, 4 entries each".format(size))
+    print("  before {0:8.1f} bytes per event".format(before / size))
+    print("  after  {0:8.1f} bytes per event".format(after / size))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+"""
+Shows how parallel parsing scales with the number of worker processes.
+
+Usage: parallel_benchmark.py [number of events [chunk size]]
+"""
+
+import os
+import sys
+
+from tempfile import NamedTemporaryFile
+
+from ledger import generate_tlk, best_of
+
+from tappio import loadf
+from tappio.lexer import ENCODING
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    chunk_size = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+
+    with NamedTemporaryFile(suffix=".tlk", delete=False) as f:
+        f.write(generate_tlk(size).encode(ENCODING))
+
+    try:
+        cpus = os.cpu_count() or 1
+        workers = [1] + [n for n in (2, 4, 8, 16, 32) if n <= cpus]
+
+        print("{0} events, {1} per chunk, {2} CPUs".format(size, chunk_size, cpus))
+        baseline = None
+        for n in workers:
+            elapsed = best_of(lambda: loadf(f.name, workers=n, chunk_size=chunk_size))
+            baseline = baseline or elapsed
+            print("  {0:>2} workers {1:8.3f} s {2:6.2f}x".format(n, elapsed, baseline / elapsed))
+    finally:
+        os.unlink(f.name)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+"""
+Compares the parser engines on synthetic ledgers.
+
+Usage: parser_benchmark.py [number of events ...]
+"""
+
+import sys
+
+from ledger import generate_tlk, best_of
+
+from tappio.lexer import Lexer, FastLexer, ENCODING
+from tappio.parser import Parser, FastParser
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10000, 100000]
+
+    for size in sizes:
+        text = generate_tlk(size)
+        data = text.encode(ENCODING)
+
+        engines = [
+            ("Parser + Lexer", lambda: Parser(Lexer().lex_string(text)).parse_document()),
+            ("Parser + FastLexer", lambda: Parser(FastLexer().lex_string(text)).parse_document()),
+            ("FastParser (str)", lambda: FastParser(text).parse_document()),
+            ("FastParser (bytes)", lambda: FastParser(data).parse_document()),
+        ]
+
+        print("{0} events, {1} bytes".format(size, len(data)))
+        baseline = None
+        for name, func in engines:
+            elapsed = best_of(func)
+            baseline = baseline or elapsed
+            print("  {0:<20} {1:8.3f} s {2:6.1f}x".format(name, elapsed, baseline / elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+"""
+Compares Writer, FastWriter and ParallelWriter (one worker per CPU) on
+synthetic ledgers.
+
+Usage: writer_benchmark.py [number of events ...]
+"""
+
+import sys
+
+from io import StringIO
+
+from ledger import generate_document, best_of
+
+from tappio.parallel import ParallelWriter
+from tappio.writer import Writer, FastWriter
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10000, 100000]
+
+    for size in sizes:
+        document = generate_document(size)
+
+        print("{0} events".format(size))
+        for pretty_print in [False, True]:
+            baseline = None
+            for writer_class in [Writer, FastWriter, ParallelWriter]:
+                write = lambda: writer_class(StringIO(), pretty_print=pretty_print).write_document(document)
+                elapsed = best_of(write)
+                baseline = baseline or elapsed
+                name = "{0}{1}".format(writer_class.__name__, " (pretty)" if pretty_print else "")
+                print("  {0:<24} {1:8.3f} s {2:6.1f}x".format(name, elapsed, baseline / elapsed))
+
+
+if __name__ == "__main__":
+    main()
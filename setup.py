@@ -38,11 +38,15 @@ Topic :: Office/Business :: Financial :: Accounting
             'tappio-merge = tappio.scripts.merge:main',
             'tappio-missing-accounts = tappio.scripts.missing_accounts:main',
             'tappio-move-entries = tappio.scripts.move_entries:main',
+            'tappio-periods = tappio.scripts.periods:main',
             'tappio-print-accounts = tappio.scripts.print_accounts:main',
             'tappio-print-earnings = tappio.scripts.print_earnings:main',
             'tappio-renumber = tappio.scripts.renumber:main',
         ]
     },
+    extras_require={
+        'numpy': ["numpy"],
+    },
     tests_require=["nose"],
     test_suite="nose.collector",
 )
@@ -18,22 +18,138 @@
 #
 
 
-__all__ = ['load', 'dump', 'loads', 'dumps', 'loadf', 'dumpf']
+__all__ = ['load', 'dump', 'loads', 'dumps', 'loadb', 'loadf', 'dumpf', 'load_stream',
+    'iterparse', 'iterparsef', 'iterdump', 'iterdumpf', 'appendf', 'source_style']
 
 
+import os
 import sys
 
-from .parser import Parser
-from .lexer import Lexer
-from .writer import Writer
+from contextlib import closing
+from io import StringIO
+
+from voitto.helpers.io import is_regular_file, map_file, mapped_file, replaced_file
+
+from .append import append_events, file_style, recover
+from .cache import Cache
+from .parser import Parser, FastParser
+from .parallel import parse_parallel, ParallelWriter, DEFAULT_CHUNK_SIZE as DEFAULT_PARALLEL_CHUNK_SIZE
+from .lexer import FastLexer, ENCODING, DEFAULT_CHUNK_SIZE
+from .writer import FastWriter
 
 
 def load(stream):
-    return Parser(Lexer().lex_file(stream)).parse_document()
+    return FastParser(stream.read()).parse_document()
+
+
+def load_stream(stream, chunk_size=DEFAULT_CHUNK_SIZE, encoding=ENCODING):
+    """Loads a document from a pipe or socket file object as data arrives.
+
+    Accepts both binary and text streams. The input is never buffered as a
+    whole; parsing proceeds as each chunk is read."""
+    with closing(FastLexer(encoding).lex_stream(stream, chunk_size)) as tokens:
+        return Parser(tokens).parse_document()
+
+
+def iterparse(stream, chunk_size=DEFAULT_CHUNK_SIZE, encoding=ENCODING):
+    """Yields the header of the document and then its events one by one.
+
+    The header is a Document with an empty event list. Neither the input
+    nor the events are kept in memory as a whole."""
+    with closing(FastLexer(encoding).lex_stream(stream, chunk_size)) as tokens:
+        for item in Parser(tokens).iterparse():
+            yield item
+
+
+def iterparsef(filename, keep_source=False, cache=None):
+    """Like iterparse, but reads a file, or stdin if filename is None.
+
+    With keep_source=True, the events read from a file can be written out
+    verbatim while iterating; see FastParser.
+
+    cache is as for loadf. A document in the cache is served from there,
+    except with keep_source=True, as the cache has no source text. After a
+    full pass over the file, the document is stored in the cache; until then
+    the events are spooled to a temporary file in their compact form."""
+    if filename is None:
+        for item in iterparse(sys.stdin):
+            yield item
+        return
+
+    if not is_regular_file(filename):
+        # Pipes and such are parsed as they are read.
+        with open(filename, "rb") as f:
+            for item in iterparse(f):
+                yield item
+        return
+
+    recover(filename)
+
+    if cache is None:
+        cache = Cache.from_environment()
+
+    if cache and not keep_source:
+        items = cache.iterload(filename)
+        if items is not None:
+            with closing(items):
+                for item in items:
+                    yield item
+            return
+
+    st = os.stat(filename)
+    with mapped_file(filename) as buffer:
+        parser = FastParser(buffer, keep_source=keep_source)
+        try:
+            if not cache:
+                for item in parser.iterparse():
+                    yield item
+            else:
+                for item in iterparse_into_cache(parser.iterparse(), cache, filename, buffer, st):
+                    yield item
+        finally:
+            if parser.source is not None:
+                # The events outlive the mapping.
+                parser.source.close()
+
+
+def iterparse_into_cache(items, cache, filename, buffer, st):
+    # The caller may modify the items, so they are packed before they are
+    # passed on.
+    header = next(items)
+    writer = cache.writer(filename, header)
+    try:
+        yield header
+
+        for event in items:
+            writer.add(event)
+            yield event
+    except BaseException:
+        writer.discard()
+        raise
+
+    writer.commit(buffer, st)
+
+
+def make_writer(stream, workers=1, chunk_size=DEFAULT_PARALLEL_CHUNK_SIZE, **kwargs):
+    if workers != 1:
+        return ParallelWriter(stream, workers=workers, chunk_size=chunk_size, **kwargs)
+    return FastWriter(stream, **kwargs)
 
 
 def dump(stream, document, **kwargs):
-    Writer(stream, **kwargs).write_document(document)
+    """Writes a document to a text stream. Keyword arguments go to
+    FastWriter, or with workers other than 1, to ParallelWriter. chunk_size
+    is accepted either way, as with loadf."""
+    make_writer(stream, **kwargs).write_document(document)
+
+
+def iterdump(stream, document, events, **kwargs):
+    """Writes the header of document, then each event as it is taken from
+    the events iterable. The events of the document itself are ignored."""
+    writer = make_writer(stream, **kwargs)
+    writer.write_header(document)
+    writer.write_events(events)
+    writer.write_footer()
 
 
 def loads(s):
@@ -44,19 +160,108 @@ def loads(s):
 def dumps(document, **kwargs):
     with closing(StringIO()) as f:
         dump(f, document, **kwargs)
+        return f.getvalue()
 
 
-def loadf(filename):
+def loadb(buffer, encoding=ENCODING, keep_source=False):
+    """Loads a document from a bytes-like buffer, such as an mmap object."""
+    return FastParser(buffer, encoding, keep_source).parse_document()
+
+
+def loadf(filename, lazy=False, workers=1, chunk_size=DEFAULT_PARALLEL_CHUNK_SIZE, cache=None,
+        keep_source=False):
+    """Loads a document from a file, or from stdin if filename is None.
+
+    With lazy=True, only the header and the account map are parsed up front.
+    The events are located in the memory-mapped file and each is parsed on
+    first access through document.events. Stdin is always read eagerly.
+
+    With workers other than 1, the events are parsed in chunks of chunk_size
+    events by that many processes, or one per CPU if workers is None.
+
+    cache is a tappio.cache.Cache for compiled documents, False to disable
+    caching, or None to use the cache configured in the environment, if any.
+    Lazily loaded documents are not stored in the cache.
+
+    With keep_source=True, the events remember their source text, so that
+    writing the document with verbatim=True copies the unmodified events
+    as they were. Such documents are parsed serially and not cached."""
     if filename is None:
         return load(sys.stdin)
-    else:
-        with open(filename, 'r', encoding='ISO-8859-15') as f:
-            return load(f)
+
+    regular_file = is_regular_file(filename)
+    if regular_file:
+        recover(filename)
+
+    if keep_source or not regular_file:
+        # Pipes and such cannot be checked against the cache, either.
+        cache = False
+    elif cache is None:
+        cache = Cache.from_environment()
+
+    if cache:
+        document = cache.load(filename)
+        if document is not None:
+            return document
+
+    if lazy:
+        return FastParser(map_file(filename), keep_source=keep_source).parse_lazy_document()
+
+    st = os.stat(filename)
+    with mapped_file(filename) as buffer:
+        if keep_source:
+            # The events outlive the mapping.
+            document = loadb(bytes(buffer), keep_source=True)
+        elif workers != 1:
+            document = parse_parallel(buffer, workers, chunk_size)
+        else:
+            document = loadb(buffer)
+
+        if cache:
+            cache.store(filename, document, buffer, st)
+
+    return document
 
 
 def dumpf(filename, document, **kwargs):
+    """Writes a document to a file, or to stdout if filename is None.
+
+    The file is replaced only once the document has been written, so it may
+    be the file that the document was lazily loaded from."""
     if filename is None:
         return dump(sys.stdout, document, **kwargs)
     else:
-        with open(filename, 'w', encoding='ISO-8859-15') as f:
+        with replaced_file(filename, 'w', encoding=ENCODING) as f:
             dump(f, document, **kwargs)
+
+
+def iterdumpf(filename, document, events, **kwargs):
+    """Like iterdump, but writes to a file, or to stdout if filename is None.
+
+    The file is replaced only after all events have been written, so the
+    events may be read from the same file, as with iterparsef."""
+    if filename is None:
+        return iterdump(sys.stdout, document, events, **kwargs)
+    else:
+        with replaced_file(filename, 'w', encoding=ENCODING) as f:
+            iterdump(f, document, events, **kwargs)
+
+
+def source_style(filename):
+    """Returns the keyword arguments for dumpf and iterdumpf to write events
+    read from a file with keep_source=True like the file: the unmodified
+    events are copied as they are and the rest are formatted to match, if
+    the formatting can be told without reading stdin or a pipe."""
+    if filename is not None and is_regular_file(filename):
+        style = file_style(filename)
+    else:
+        style = {}
+    return dict(style, verbatim=True)
+
+
+def appendf(filename, events, **kwargs):
+    """Appends events to the end of the event list of a file in place.
+
+    Only the closing parens at the end of the file are rewritten, so this
+    takes time in proportion to the new events. See tappio.append."""
+    append_events(filename, events, **kwargs)
@@ -0,0 +1,163 @@
+# Voitto - a simple yet efficient double ledger bookkeeping system
+# Copyright (C) 2010 Santtu Pajukanta <santtu@pajukanta.fi>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+
+"""
+Group-by sums over the columns of an EntryTable.
+
+NumPy is used when it is installed, pure Python otherwise. Both give the
+same results: the sums are done in integers, never in floating point.
+"""
+
+
+from collections import defaultdict
+from datetime import date
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def python_sum_by_account(table, before=None):
+    totals = defaultdict(int)
+
+    if before is None:
+        for account_number, cents in zip(table.account_numbers, table.cents):
+            totals[account_number] += cents
+    else:
+        before = before.toordinal()
+        for ordinal, account_number, cents in zip(table.date_ordinals, table.account_numbers, table.cents):
+            if ordinal < before:
+                totals[account_number] += cents
+
+    return totals
+
+
+def python_sum_by_account_and_month(table):
+    totals = defaultdict(int)
+    months = dict()
+
+    for ordinal, account_number, cents in zip(table.date_ordinals, table.account_numbers, table.cents):
+        month = months.get(ordinal)
+        if month is None:
+            day = date.fromordinal(ordinal)
+            month = months[ordinal] = (day.year, day.month)
+        totals[(account_number,) + month] += cents
+
+    return totals
+
+
+def column(values):
+    # Shares the memory of the array.array instead of copying it.
+    return numpy.frombuffer(values, dtype=numpy.dtype(values.typecode))
+
+
+# Keys spanning at most this many values, or as many as there are rows, are
+# summed into a dense array instead of sorting the rows.
+DENSE_LIMIT = 1 << 20
+
+
+def group_sums(keys, cents):
+    """Sums the cents of the rows with equal values in all of the key
+    columns. Returns the distinct keys, one list per column, and their sums."""
+    lows = [int(key.min()) for key in keys]
+    spans = [int(key.max()) - low + 1 for key, low in zip(keys, lows)]
+
+    size = 1
+    for span in spans:
+        size *= span
+
+    if size > max(len(cents), DENSE_LIMIT):
+        return sorted_group_sums(keys, cents)
+
+    index = numpy.zeros(len(cents), dtype=numpy.int64)
+    for key, low, span in zip(keys, lows, spans):
+        index *= span
+        index += key - low
+
+    sums = numpy.zeros(size, dtype=numpy.int64)
+    numpy.add.at(sums, index, cents)
+    seen = numpy.zeros(size, dtype=bool)
+    seen[index] = True
+    found = numpy.flatnonzero(seen)
+
+    result = []
+    rest = found
+    for low, span in reversed(list(zip(lows, spans))):
+        rest, offset = numpy.divmod(rest, span)
+        result.append((offset + low).tolist())
+    return result[::-1], sums[found].tolist()
+
+
+def sorted_group_sums(keys, cents):
+    order = numpy.lexsort(keys)
+    keys = [key[order] for key in keys]
+
+    changed = numpy.zeros(len(order), dtype=bool)
+    changed[0] = True
+    for key in keys:
+        changed[1:] |= key[1:] != key[:-1]
+    starts = numpy.flatnonzero(changed)
+
+    sums = numpy.add.reduceat(cents[order], starts)
+    return [key[starts].tolist() for key in keys], sums.tolist()
+
+
+def numpy_sum_by_account(table, before=None):
+    totals = defaultdict(int)
+    account_numbers = column(table.account_numbers)
+    cents = column(table.cents)
+
+    if before is not None:
+        mask = column(table.date_ordinals) < before.toordinal()
+        account_numbers = account_numbers[mask]
+        cents = cents[mask]
+
+    if len(cents):
+        (keys,), sums = group_sums([account_numbers], cents)
+        totals.update(zip(keys, sums))
+
+    return totals
+
+
+EPOCH = date(1970, 1, 1).toordinal()
+
+
+def numpy_sum_by_account_and_month(table):
+    totals = defaultdict(int)
+    if not len(table):
+        return totals
+
+    days = column(table.date_ordinals) - EPOCH
+    months = days.astype("datetime64[D]").astype("datetime64[M]").astype(numpy.int64)
+
+    (months, account_numbers), sums = group_sums([months, column(table.account_numbers)], column(table.cents))
+    for account_number, month, cents in zip(account_numbers, months, sums):
+        year, month = divmod(month, 12)
+        totals[(account_number, 1970 + year, month + 1)] = cents
+
+    return totals
+
+
+if numpy is not None:
+    sum_by_account = numpy_sum_by_account
+    sum_by_account_and_month = numpy_sum_by_account_and_month
+else:
+    sum_by_account = python_sum_by_account
+    sum_by_account_and_month = python_sum_by_account_and_month
@@ -0,0 +1,215 @@
+# Voitto - a simple yet efficient double ledger bookkeeping system
+# Copyright (C) 2010 Santtu Pajukanta <santtu@pajukanta.fi>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+
+"""
+Appending events to a TLK file without rewriting it.
+
+A TLK file ends with the closing parens of the event list, the fiscal year
+and the document. New events are written over this tail, which is then
+written again after them. The rest of the file is left untouched.
+
+Before the file is modified, the offset and the old tail are saved in a
+journal next to it. If appending is interrupted, recover() puts the old
+tail back and the file is as it was. It is called by every append, and by
+loadf and iterparsef before they read a file.
+
+Appending and recovering hold a lock on the file where fcntl is available,
+so recover() waits for an append in progress instead of undoing it. Reading
+does not take the lock, though, so a reader that has the file open while it
+is being appended to may still see it halfway written.
+"""
+
+
+import os
+import struct
+
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from .lexer import ENCODING
+from .parser import ParserError
+from .writer import FastWriter, DEFAULT_INDENT
+
+
+JOURNAL_SUFFIX = ".journal"
+# Offset of the tail and its length.
+JOURNAL_HEADER = struct.Struct("<QQ")
+
+WHITESPACE = b" \t\r\n"
+CLOSE = b")"[0]
+OPEN = b"("[0]
+
+# Closing parens after the last event: event list, fiscal year, document.
+TAIL_PARENS = 3
+
+# Depth of the events in a pretty printed document.
+EVENT_DEPTH = 3
+
+TAIL_READ_SIZE = 4096
+
+
+def journal_path(filename):
+    return filename + JOURNAL_SUFFIX
+
+
+def find_tail(f):
+    """Returns the offset right after the last event, or after the opening
+    paren of an empty event list, and the bytes from there to the end."""
+    size = f.seek(0, 2)
+    read_size = TAIL_READ_SIZE
+
+    while True:
+        start = max(0, size - read_size)
+        f.seek(start)
+        data = f.read(size - start)
+
+        parens = 0
+        pos = len(data)
+        while pos > 0:
+            ch = data[pos - 1]
+            if ch == CLOSE and parens < TAIL_PARENS:
+                parens += 1
+            elif ch not in WHITESPACE:
+                break
+            pos -= 1
+
+        if pos > 0:
+            if parens < TAIL_PARENS or data[pos - 1] not in (CLOSE, OPEN):
+                raise ParserError("cannot find the end of the event list")
+            return start + pos, data[pos:], data[pos - 1] == OPEN
+
+        if start == 0:
+            raise ParserError("cannot find the end of the event list")
+        read_size *= 4
+
+
+def detect_style(tail):
+    """Returns pretty_print and indent matching the tail of a file written
+    by Writer."""
+    before_close = tail.split(b")", 1)[0]
+    if b"\n" not in before_close:
+        return False, DEFAULT_INDENT
+
+    # The event list is closed on its own line at depth 2.
+    last_line = before_close.rsplit(b"\n", 1)[1].decode(ENCODING)
+    return True, last_line[:len(last_line) // 2]
+
+
+def file_style(filename):
+    """Returns the Writer keyword arguments matching the formatting of a
+    file, or none if it cannot be told."""
+    try:
+        with open(filename, "rb") as f:
+            offset, tail, empty = find_tail(f)
+    except ParserError:
+        return {}
+
+    pretty_print, indent = detect_style(tail)
+    return dict(pretty_print=pretty_print, indent=indent)
+
+
+def render_events(events, empty, pretty_print, indent):
+    writer = FastWriter(None, pretty_print, indent)
+    writer.indent_depth = EVENT_DEPTH
+    return writer.render_events(events, first=empty)
+
+
+@contextmanager
+def locked(f):
+    """Holds an exclusive lock on an open file, where fcntl is available."""
+    if fcntl is None:
+        yield
+        return
+
+    fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+    try:
+        yield
+    finally:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def recover(filename):
+    """Undoes an interrupted append, if there is a journal for the file.
+    Returns True if the file was restored."""
+    if not os.path.exists(journal_path(filename)):
+        return False
+
+    with open(filename, "r+b") as f, locked(f):
+        return restore(filename, f)
+
+
+def restore(filename, f):
+    path = journal_path(filename)
+    try:
+        with open(path, "rb") as journal:
+            data = journal.read()
+    except FileNotFoundError:
+        return False
+
+    if len(data) < JOURNAL_HEADER.size or len(data) != JOURNAL_HEADER.size + JOURNAL_HEADER.unpack_from(data)[1]:
+        # The journal itself was not completely written, so the file has
+        # not been touched yet.
+        os.unlink(path)
+        return False
+
+    offset, length = JOURNAL_HEADER.unpack_from(data)
+    f.seek(offset)
+    f.write(data[JOURNAL_HEADER.size:])
+    f.truncate()
+    f.flush()
+    os.fsync(f.fileno())
+
+    os.unlink(path)
+    return True
+
+
+def append_events(filename, events, pretty_print=None, indent=None, encoding=ENCODING):
+    """Appends events to the event list of a TLK file in place.
+
+    By default, the events are formatted like the rest of the file, compact
+    or pretty printed. The events are neither sorted nor renumbered."""
+    with open(filename, "r+b") as f, locked(f):
+        restore(filename, f)
+        offset, tail, empty = find_tail(f)
+
+        detected_pretty_print, detected_indent = detect_style(tail)
+        if pretty_print is None:
+            pretty_print = detected_pretty_print
+        if indent is None:
+            indent = detected_indent
+
+        data = render_events(events, empty, pretty_print, indent).encode(encoding)
+        if not data:
+            return
+
+        with open(journal_path(filename), "wb") as journal:
+            journal.write(JOURNAL_HEADER.pack(offset, len(tail)) + tail)
+            journal.flush()
+            os.fsync(journal.fileno())
+
+        f.seek(offset)
+        f.write(data + tail)
+        f.flush()
+        os.fsync(f.fileno())
+
+        os.unlink(journal_path(filename))
@@ -0,0 +1,121 @@
+# Voitto - a simple yet efficient double ledger bookkeeping system
+# Copyright (C) 2010 Santtu Pajukanta <santtu@pajukanta.fi>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+
+"""
+Running balances of accounts along the date axis.
+"""
+
+
+from array import array
+from bisect import bisect_left, bisect_right
+
+
+class RunningBalances(object):
+    """Cumulative totals of each account by date.
+
+    For every account number, ordinals holds the distinct dates of its
+    entries as given by date.toordinal(), and totals the balance of the
+    account at the end of each of these dates. A balance at any date is then
+    found by bisecting the dates."""
+
+    def __init__(self, events=()):
+        self.ordinals = dict()
+        self.totals = dict()
+        self.num_events = 0
+
+        for event in events:
+            self.add_event(event)
+
+    def __len__(self):
+        return self.num_events
+
+    def __contains__(self, account_number):
+        return account_number in self.totals
+
+    def add_event(self, event):
+        """Adds the entries of an event. This is quickest when the events
+        come in date order, but any order works."""
+        ordinal = event.date.toordinal()
+        self.num_events += 1
+
+        for entry in event.entries:
+            self.add(entry.account_number, ordinal, entry.cents)
+
+    def add(self, account_number, ordinal, cents):
+        ordinals = self.ordinals.get(account_number)
+        if ordinals is None:
+            self.ordinals[account_number] = array("l", [ordinal])
+            self.totals[account_number] = array("q", [cents])
+            return
+
+        totals = self.totals[account_number]
+        last = ordinals[-1]
+
+        if ordinal == last:
+            totals[-1] += cents
+        elif ordinal > last:
+            ordinals.append(ordinal)
+            totals.append(totals[-1] + cents)
+        else:
+            # Back-dated entry: every later total moves by the same amount.
+            index = bisect_left(ordinals, ordinal)
+            if ordinals[index] != ordinal:
+                ordinals.insert(index, ordinal)
+                totals.insert(index, totals[index - 1] if index > 0 else 0)
+            for i in range(index, len(totals)):
+                totals[i] += cents
+
+    def lookup(self, account_number, ordinal):
+        """Returns the number of dates of the account up to and including
+        the ordinal, and the balance at the end of the last of them."""
+        ordinals = self.ordinals.get(account_number)
+        if ordinals is None:
+            return 0, 0
+
+        index = bisect_right(ordinals, ordinal)
+        return index, self.totals[account_number][index - 1] if index else 0
+
+    def balance_at(self, account_number, at_date):
+        """Returns the balance of an account at the end of the given date."""
+        return self.lookup(account_number, at_date.toordinal())[1]
+
+    def balance_before(self, account_number, at_date):
+        """Returns the balance of an account at the start of the given date."""
+        return self.lookup(account_number, at_date.toordinal() - 1)[1]
+
+    def balances_before(self, at_date, account_numbers=None):
+        """Returns the balances at the start of the given date of the
+        accounts that have entries before it, optionally only those in
+        account_numbers."""
+        return self.collect(at_date.toordinal() - 1, account_numbers)
+
+    def balances_at(self, at_date, account_numbers=None):
+        """Like balances_before(), but includes the entries of the given date."""
+        return self.collect(at_date.toordinal(), account_numbers)
+
+    def collect(self, ordinal, account_numbers=None):
+        if account_numbers is None:
+            account_numbers = self.totals
+
+        result = dict()
+        for account_number in account_numbers:
+            count, cents = self.lookup(account_number, ordinal)
+            if count:
+                result[account_number] = cents
+        return result
@@ -0,0 +1,286 @@
+# Voitto - a simple yet efficient double ledger bookkeeping system
+# Copyright (C) 2010 Santtu Pajukanta <santtu@pajukanta.fi>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+
+"""
+A cache of compiled documents, stored as .tlkc files.
+
+A compiled document is keyed by the size, modification time and content
+hash of its source. When size and modification time match, the cached copy
+is used as is. When only the modification time differs, the content hash
+decides. Otherwise the cached copy is stale and is replaced.
+
+The cache is opt-in. Either pass a Cache to loadf or iterparsef, or set the
+environment:
+
+TAPPIO_CACHE=1                store compiled documents next to their sources
+TAPPIO_CACHE_DIR=/some/path   store them in a cache directory instead
+TAPPIO_CACHE_MAX_SIZE=bytes   evict least recently used documents beyond this
+"""
+
+
+import hashlib
+import marshal
+import os
+import shutil
+import struct
+
+from tempfile import NamedTemporaryFile, TemporaryFile
+
+from .compact import pack_header, unpack_header, pack_event, unpack_event
+
+
+SUFFIX = ".tlkc"
+MAGIC = b"TLKC"
+FORMAT_VERSION = 2
+# Magic, format version, length of the key and number of events. The key
+# follows, then the header of the document and the events in blocks.
+HEADER = struct.Struct("<4sIIQ")
+
+EVENT_BLOCK_SIZE = 1000
+HASH_READ_SIZE = 1 << 20
+
+
+def content_hash(buffer):
+    return hashlib.blake2b(buffer, digest_size=20).digest()
+
+
+def file_content_hash(filename):
+    digest = hashlib.blake2b(digest_size=20)
+    with open(filename, "rb") as f:
+        for data in iter(lambda: f.read(HASH_READ_SIZE), b""):
+            digest.update(data)
+    return digest.digest()
+
+
+class Cache(object):
+    def __init__(self, directory=None, max_size=None):
+        self.directory = directory
+        self.max_size = max_size
+
+    @classmethod
+    def from_environment(cls, environ=os.environ):
+        """Returns the Cache configured in the environment, or None."""
+        directory = environ.get("TAPPIO_CACHE_DIR") or None
+        max_size = environ.get("TAPPIO_CACHE_MAX_SIZE")
+        max_size = int(max_size) if max_size else None
+
+        if directory is None and environ.get("TAPPIO_CACHE", "") in ("", "0"):
+            return None
+
+        return cls(directory, max_size)
+
+    def path_for(self, filename):
+        if self.directory is None:
+            base = filename[:-len(".tlk")] if filename.endswith(".tlk") else filename
+            return base + SUFFIX
+        else:
+            name = hashlib.blake2b(os.path.realpath(filename).encode("utf-8"), digest_size=16)
+            return os.path.join(self.directory, name.hexdigest() + SUFFIX)
+
+    def load(self, filename):
+        """Returns the cached document for the source file, or None."""
+        items = self.iterload(filename)
+        if items is None:
+            return None
+
+        try:
+            document = next(items)
+            document.events = list(items)
+        except (ValueError, EOFError, TypeError):
+            return None
+
+        return document
+
+    def iterload(self, filename):
+        """Returns an iterator over the header and then the events of the
+        cached document for the source file, like iterparse, or None."""
+        path = self.path_for(filename)
+
+        try:
+            f = open(path, "rb")
+        except OSError:
+            return None
+
+        try:
+            magic, version, key_length, num_events = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC or version != FORMAT_VERSION:
+                f.close()
+                return None
+
+            size, mtime, digest = marshal.loads(f.read(key_length))
+
+            st = os.stat(filename)
+            if st.st_size != size or st.st_mtime_ns != mtime and file_content_hash(filename) != digest:
+                f.close()
+                return None
+            elif st.st_mtime_ns != mtime:
+                # Touched but not modified, so remember the new time.
+                body_start = f.tell()
+                self.write(path, (size, st.st_mtime_ns, digest), num_events, f)
+                f.seek(body_start)
+
+            header = unpack_header(marshal.load(f))
+        except (OSError, ValueError, EOFError, TypeError, struct.error):
+            f.close()
+            return None
+
+        if self.directory is not None:
+            # Mark as recently used for eviction.
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+
+        return self.iter_items(f, header, num_events)
+
+    def iter_items(self, f, header, num_events):
+        with f:
+            yield header
+
+            dates = {}
+            while num_events > 0:
+                block = marshal.load(f)
+                num_events -= len(block)
+                for packed in block:
+                    yield unpack_event(packed, dates)
+                del block
+
+    def writer(self, filename, header):
+        """Returns a CacheWriter for a document compiled from the source file."""
+        return CacheWriter(self, filename, header)
+
+    def store(self, filename, document, buffer, st):
+        """Stores a document compiled from the source file.
+
+        buffer is the content of the source file and st its os.stat result
+        from before it was read. Failing to write the cache is not an error."""
+        writer = self.writer(filename, document)
+        for event in document.events:
+            writer.add(event)
+        writer.commit(buffer, st)
+
+    def store_body(self, filename, key, num_events, body):
+        path = self.path_for(filename)
+
+        if self.directory is not None:
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+            except OSError:
+                return
+
+        self.write(path, key, num_events, body)
+
+        if self.directory is not None and self.max_size is not None:
+            self.evict(keep=path)
+
+    def write(self, path, key, num_events, body):
+        """Writes a cache file with the rest of the body file as its body."""
+        key = marshal.dumps(key)
+
+        try:
+            f = NamedTemporaryFile(dir=os.path.dirname(os.path.abspath(path)),
+                suffix=SUFFIX + ".tmp", delete=False)
+        except OSError:
+            return
+
+        try:
+            with f:
+                f.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(key), num_events))
+                f.write(key)
+                shutil.copyfileobj(body, f)
+
+            os.replace(f.name, path)
+        except OSError:
+            try:
+                os.unlink(f.name)
+            except OSError:
+                pass
+
+    def evict(self, keep=None):
+        """Removes the least recently used documents from the cache directory
+        until it is no larger than max_size."""
+        entries = []
+        total = 0
+
+        for name in os.listdir(self.directory):
+            if not name.endswith(SUFFIX):
+                continue
+
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+
+            entries.append((st.st_mtime_ns, st.st_size, path))
+            total += st.st_size
+
+        entries.sort()
+
+        for mtime, size, path in entries:
+            if total <= self.max_size:
+                break
+            elif path == keep:
+                continue
+
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+
+            total -= size
+
+
+class CacheWriter(object):
+    """Stores a document in the cache as its events are added, spooling them
+    to a temporary file rather than keeping them in memory. The header and
+    the events are packed when given, so they may be modified afterwards."""
+
+    def __init__(self, cache, filename, header):
+        self.cache = cache
+        self.filename = filename
+        self.spool = TemporaryFile()
+        self.block = []
+        self.num_events = 0
+
+        marshal.dump(pack_header(header), self.spool)
+
+    def add(self, event):
+        self.block.append(pack_event(event))
+        self.num_events += 1
+        if len(self.block) >= EVENT_BLOCK_SIZE:
+            self.flush()
+
+    def flush(self):
+        marshal.dump(self.block, self.spool)
+        self.block = []
+
+    def commit(self, buffer, st):
+        """Puts the document in the cache. buffer and st are as for
+        Cache.store."""
+        if self.block:
+            self.flush()
+
+        self.spool.seek(0)
+        with self.spool:
+            key = (st.st_size, st.st_mtime_ns, content_hash(buffer))
+            self.cache.store_body(self.filename, key, self.num_events, self.spool)
+
+    def discard(self):
+        self.spool.close()
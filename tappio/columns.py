@@ -0,0 +1,73 @@
+# Voitto - a simple yet efficient double ledger bookkeeping system
+# Copyright (C) 2010 Santtu Pajukanta <santtu@pajukanta.fi>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+
+"""
+A columnar view of the entries of a ledger.
+"""
+
+
+from array import array
+
+from . import aggregate
+
+
+class EntryTable(object):
+    """The entries of a list of events as parallel arrays, one row per entry.
+
+    event_indices   index of the event in the list
+    date_ordinals   date of the event as given by date.toordinal()
+    account_numbers account number of the entry
+    cents           amount of the entry"""
+
+    def __init__(self, events=()):
+        self.event_indices = array("q")
+        self.date_ordinals = array("l")
+        self.account_numbers = array("q")
+        self.cents = array("q")
+        self.num_events = 0
+
+        for event in events:
+            self.append_event(event)
+
+    def __len__(self):
+        return len(self.cents)
+
+    def append_event(self, event):
+        entries = event.entries
+        count = len(entries)
+
+        self.event_indices.extend([self.num_events] * count)
+        self.num_events += 1
+        self.date_ordinals.extend([event.date.toordinal()] * count)
+        self.account_numbers.extend([entry.account_number for entry in entries])
+        self.cents.extend([entry.cents for entry in entries])
+
+    def rows(self):
+        """Yields (event index, date ordinal, account number, cents) for each entry."""
+        return zip(self.event_indices, self.date_ordinals, self.account_numbers, self.cents)
+
+    def sum_by_account(self, before=None):
+        """Returns the total cents of each account, optionally only counting
+        the events dated before the given date."""
+        return aggregate.sum_by_account(self, before)
+
+    def sum_by_account_and_month(self):
+        """Returns the total cents of each account in each month, keyed by
+        (account number, year, month)."""
+        return aggregate.sum_by_account_and_month(self)
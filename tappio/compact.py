@@ -0,0 +1,110 @@
+# Voitto - a simple yet efficient double ledger bookkeeping system
+# Copyright (C) 2010 Santtu Pajukanta <santtu@pajukanta.fi>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+
+"""
+A compact marshal-based serialization of events and documents.
+
+Each event becomes a tuple of its number, the ordinal of its date, its
+description and a flat tuple of alternating account numbers and cents.
+"""
+
+
+import marshal
+
+from datetime import date
+
+from .models import Document, Account, Event, Entry
+
+
+def pack_event(event):
+    flat_entries = []
+    for entry in event.entries:
+        flat_entries.append(entry.account_number)
+        flat_entries.append(entry.cents)
+
+    return (event.number, event.date.toordinal(), event.description, tuple(flat_entries))
+
+
+def unpack_event(packed, dates):
+    number, ordinal, description, flat_entries = packed
+
+    event_date = dates.get(ordinal)
+    if event_date is None:
+        event_date = dates[ordinal] = date.fromordinal(ordinal)
+
+    entries = [Entry(flat_entries[i], flat_entries[i + 1]) for i in range(0, len(flat_entries), 2)]
+    return Event(number, event_date, description, entries)
+
+
+def pack_events(events):
+    return marshal.dumps([pack_event(event) for event in events])
+
+
+def unpack_events(data):
+    dates = {}
+    return [unpack_event(packed, dates) for packed in marshal.loads(data)]
+
+
+def pack_account(account):
+    return (account.number, account.name, account.vat_type, account.vat_percent,
+        tuple(pack_account(subaccount) for subaccount in account.subaccounts))
+
+
+def unpack_account(packed):
+    number, name, vat_type, vat_percent, subaccounts = packed
+    return Account(number, name, [unpack_account(subaccount) for subaccount in subaccounts],
+        vat_type, vat_percent)
+
+
+def pack_header(document):
+    return (
+        document.identity,
+        document.version,
+        document.name,
+        document.begin.toordinal(),
+        document.end.toordinal(),
+        tuple(pack_account(account) for account in document.accounts),
+    )
+
+
+def unpack_header(packed):
+    """Returns the Document of a packed header, without events."""
+    identity, version, name, begin, end, accounts = packed
+
+    return Document(
+        identity=identity,
+        version=version,
+        name=name,
+        begin=date.fromordinal(begin),
+        end=date.fromordinal(end),
+        accounts=[unpack_account(account) for account in accounts],
+    )
+
+
+def pack_document(document):
+    return marshal.dumps(pack_header(document) + ([pack_event(event) for event in document.events],))
+
+
+def unpack_document(data):
+    packed = marshal.loads(data)
+    document = unpack_header(packed[:-1])
+
+    dates = {}
+    document.events = [unpack_event(event, dates) for event in packed[-1]]
+    return document
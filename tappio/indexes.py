@@ -0,0 +1,198 @@
+# Voitto - a simple yet efficient double ledger bookkeeping system
+# Copyright (C) 2010 Santtu Pajukanta <santtu@pajukanta.fi>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+
+"""
+Indexes over the accounts and events of a Document.
+
+These are built by the Document on first use and rebuilt when out of date;
+see Document.
+"""
+
+from array import array
+from bisect import bisect_left, bisect_right
+from collections.abc import Sequence
+
+
+ASSETS = "assets"
+LIABILITIES = "liabilities"
+EARNINGS = "earnings"
+
+# The meanings of the three account trees, in order.
+TREES = (ASSETS, LIABILITIES, EARNINGS)
+
+
+class AccountIndex(object):
+    """Flattens the account forest of a Document for quick lookups.
+
+    Iterating over the index yields all accounts, groups included, in
+    depth-first order."""
+
+    def __init__(self, accounts):
+        self.by_number = dict()
+        self.parents = dict()
+        self.depths = dict()
+        self.trees = dict()
+        self.order = list()
+
+        for tree, root in zip(self.tree_names(len(accounts)), accounts):
+            self.add_tree(root, tree)
+
+    @staticmethod
+    def tree_names(count):
+        return TREES[:count] + (None,) * (count - len(TREES))
+
+    def add_tree(self, root, tree):
+        stack = [(root, None, 0)]
+
+        while stack:
+            account, parent, depth = stack.pop()
+
+            if account.number is not None:
+                self.by_number.setdefault(account.number, account)
+
+            self.parents[account] = parent
+            self.depths[account] = depth
+            self.trees[account] = tree
+            self.order.append(account)
+
+            for subaccount in reversed(account.subaccounts):
+                stack.append((subaccount, account, depth + 1))
+
+    def __iter__(self):
+        return iter(self.order)
+
+    def __len__(self):
+        return len(self.order)
+
+    def __contains__(self, number):
+        return number in self.by_number
+
+    def __getitem__(self, number):
+        return self.by_number[number]
+
+    def get(self, number, default=None):
+        return self.by_number.get(number, default)
+
+    def parent(self, account):
+        return self.parents[account]
+
+    def ancestors(self, account):
+        """Returns the parent, grandparent etc. of an account, root last."""
+        result = []
+        parent = self.parents[account]
+        while parent is not None:
+            result.append(parent)
+            parent = self.parents[parent]
+        return result
+
+    def depth(self, account):
+        return self.depths[account]
+
+    def tree(self, account):
+        """Returns ASSETS, LIABILITIES or EARNINGS, depending on the tree the
+        account is in."""
+        return self.trees[account]
+
+    def tree_of(self, number):
+        """Like tree(), but takes an account number. None for unknown accounts."""
+        account = self.by_number.get(number)
+        return self.trees[account] if account is not None else None
+
+    def is_balance_sheet(self, number):
+        return self.tree_of(number) in (ASSETS, LIABILITIES)
+
+    def numbers(self, *trees):
+        """Returns the set of account numbers in the given trees, or in all of them."""
+        return set(number for number, account in self.by_number.items()
+            if not trees or self.trees[account] in trees)
+
+
+def event_sort_key(event):
+    return (event.date, event.number)
+
+
+class DateIndex(object):
+    """Orders the events of a Document by (date, number) for range queries.
+
+    positions   indices of the events in the list, in date order, or a
+                range if the list is already in date order
+    ordinals    dates of the events in the same order, as given by
+                date.toordinal()"""
+
+    def __init__(self, events):
+        self.num_events = len(events)
+        self.is_sorted = self.check_sorted(events)
+
+        if self.is_sorted:
+            self.positions = range(len(events))
+        else:
+            self.positions = sorted(range(len(events)), key=lambda i: event_sort_key(events[i]))
+
+        self.ordinals = array("l", [events[i].date.toordinal() for i in self.positions])
+
+    @staticmethod
+    def check_sorted(events):
+        previous = None
+        for event in events:
+            key = event_sort_key(event)
+            if previous is not None and key < previous:
+                return False
+            previous = key
+        return True
+
+    def __len__(self):
+        return self.num_events
+
+    def span(self, from_date=None, to_date=None):
+        """Returns the slice of positions dated from_date to to_date, both
+        inclusive. None leaves that end open."""
+        start = 0 if from_date is None else bisect_left(self.ordinals, from_date.toordinal())
+        stop = len(self.ordinals) if to_date is None else bisect_right(self.ordinals, to_date.toordinal())
+        return slice(start, max(start, stop))
+
+    def between(self, events, from_date=None, to_date=None):
+        return EventRange(events, self.positions[self.span(from_date, to_date)])
+
+
+class EventRange(Sequence):
+    """A read-only view of some events of a list, in date order.
+
+    positions holds the indices of the events in the underlying list. The
+    view is not updated if the list is modified."""
+
+    def __init__(self, events, positions):
+        self.events = events
+        self.positions = positions
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return EventRange(self.events, self.positions[index])
+        return self.events[self.positions[index]]
+
+    def __iter__(self):
+        events = self.events
+        for position in self.positions:
+            yield events[position]
+
+    def in_document_order(self):
+        """Returns the events of the view as a list, in their original order."""
+        return [self.events[i] for i in sorted(self.positions)]
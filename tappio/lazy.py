@@ -0,0 +1,89 @@
+# Voitto - a simple yet efficient double ledger bookkeeping system
+# Copyright (C) 2010 Santtu Pajukanta <santtu@pajukanta.fi>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+
+"""
+Lazily decoded event lists.
+"""
+
+
+from collections.abc import MutableSequence
+
+
+class LazyEventList(MutableSequence):
+    """A list of events that are parsed from the source buffer on first access.
+
+    The parser has only recorded where each event starts and ends. Events
+    added to the list later have no source and are always kept decoded."""
+
+    def __init__(self, parser, starts, ends):
+        self.parser = parser
+        self.starts = starts
+        self.ends = ends
+        self.events = [None] * len(starts)
+
+    def __len__(self):
+        return len(self.events)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        event = self.events[index]
+        if event is None:
+            event = self.events[index] = self.parser.parse_event_at(self.starts[index], self.ends[index])
+        return event
+
+    def __iter__(self):
+        for index in range(len(self.events)):
+            yield self[index]
+
+    def __setitem__(self, index, event):
+        if isinstance(index, slice):
+            # Let list handle the slice arithmetic.
+            events = list(self)
+            events[index] = event
+            self.clear()
+            self.extend(events)
+            return
+
+        self.events[index] = event
+        self.starts[index] = self.ends[index] = -1
+
+    def __delitem__(self, index):
+        del self.events[index]
+        del self.starts[index]
+        del self.ends[index]
+
+    def insert(self, index, event):
+        self.events.insert(index, event)
+        self.starts.insert(index, -1)
+        self.ends.insert(index, -1)
+
+    def sort(self, key=None, reverse=False):
+        events = sorted(self, key=key, reverse=reverse)
+        self.clear()
+        self.extend(events)
+
+    def clear(self):
+        self.events = []
+        del self.starts[:]
+        del self.ends[:]
+
+    def is_decoded(self, index):
+        return self.events[index] is not None
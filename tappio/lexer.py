@@ -19,7 +19,11 @@
 A lexer for the Tappio file format.
 """
 
+import codecs
+import re
+
 from collections import namedtuple
+from io import IncrementalNewlineDecoder
 
 TOKENS = (
     'brace_open',
@@ -166,3 +170,245 @@ class Lexer(object):
     def string_escape(self, ch):
         self.save(ch)
         self.enter("string")
+
+
+# The fast lexer scans whole runs with a single master expression instead of
+# dispatching on every character. Its output is identical to that of Lexer,
+# which is kept around as the reference implementation.
+
+SYMBOL_START_CLASS = "a-zA-Z!$%&/+?_*"
+SYMBOL_CLASS = SYMBOL_START_CLASS + r"\-"
+
+# Like Lexer, report a bad character right after an integer or a symbol
+# before the token itself is emitted. The lookaheads exclude the characters
+# that would continue the token to prevent backtracking into a shorter one.
+TOKEN_PATTERN = r"""
+    [ \t\r\n]+                              # whitespace
+  | (\()                                    # 1: brace_open
+  | (\))                                    # 2: brace_close
+  | (-[0-9]*|[0-9]+)                        # 3: integer
+    (?=[ \t\r\n()"{chars}]|\Z)
+  | ([{start}][{chars}]*)                   # 4: symbol
+    (?=[ \t\r\n()"0-9]|\Z)
+  | "((?:[^"\\]|\\.)*)"                     # 5: string
+  | (?:-[0-9]*|[0-9]+|[{start}][{chars}]*)
+    (.)                                     # 6: bad character after a token
+  | (.)                                     # 7: anything else is an error
+""".format(start=SYMBOL_START_CLASS, chars=SYMBOL_CLASS)
+
+TOKEN_RE = re.compile(TOKEN_PATTERN, re.VERBOSE | re.DOTALL)
+ESCAPE_RE = re.compile(r'\\(.)', re.DOTALL)
+
+BRACE_OPEN = Token("brace_open", "")
+BRACE_CLOSE = Token("brace_close", "")
+
+ENCODING = "ISO-8859-15"
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+DEFAULT_MAX_PENDING = 1024 * 1024
+
+
+class FastLexer(object):
+    """A drop-in replacement for Lexer that works on whole buffers.
+
+    Produces the same Token stream and raises the same LexerErrors.
+
+    Input can also be fed in arbitrary chunks with feed_chunk() and close().
+    Only the token that is cut by the end of a chunk is kept between calls,
+    and it may not grow beyond max_pending characters."""
+
+    token_re = TOKEN_RE
+    escape_re = ESCAPE_RE
+    newline = "\n"
+    quote = '"'
+    empty = ""
+
+    def __init__(self, encoding=ENCODING, max_pending=DEFAULT_MAX_PENDING):
+        self.encoding = encoding
+        self.max_pending = max_pending
+        self.buffer = self.empty
+        self.pos = 0
+        self.line_base = 0
+        self.decoder = None
+
+    @property
+    def linenum(self):
+        return self.line_base + self.buffer.count(self.newline, 0, self.pos) + 1
+
+    @property
+    def chnum(self):
+        return self.pos - self.buffer.rfind(self.newline, 0, self.pos)
+
+    def lex_file(self, f):
+        return self.lex_string(f.read())
+
+    def lex_string(self, s):
+        self.buffer = s
+        return self.scan(s, final=True)
+
+    def lex_stream(self, stream, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Lexes a file, pipe or socket file object as data arrives."""
+        read = getattr(stream, "read1", None) or stream.read
+
+        while True:
+            chunk = read(chunk_size)
+            if not chunk:
+                break
+            for token in self.advance(self.decode_chunk(chunk, final=False), final=False):
+                yield token
+
+        for token in self.advance(self.decode_chunk(None, final=True), final=True):
+            yield token
+
+    def feed_chunk(self, chunk):
+        """Lexes the next chunk of input and returns the completed tokens."""
+        return list(self.advance(self.decode_chunk(chunk, final=False), final=False))
+
+    def close(self):
+        """Lexes whatever remains of the chunked input."""
+        return list(self.advance(self.decode_chunk(None, final=True), final=True))
+
+    def advance(self, data, final):
+        self.line_base += self.buffer.count(self.newline, 0, self.pos)
+        self.buffer = self.buffer[self.pos:] + data
+
+        for token in self.scan(self.buffer, final=final):
+            yield token
+
+        if len(self.buffer) - self.pos > self.max_pending:
+            raise LexerError("token longer than {0} characters".format(self.max_pending))
+
+    def decode_chunk(self, chunk, final):
+        if isinstance(chunk, str):
+            return chunk
+
+        if self.decoder is None:
+            # Behave like a text mode file, universal newlines included.
+            decoder = codecs.getincrementaldecoder(self.encoding)()
+            self.decoder = IncrementalNewlineDecoder(decoder, translate=True)
+
+        return self.decoder.decode(chunk or b"", final)
+
+    def integer(self, value):
+        return value
+
+    def symbol(self, value):
+        return value
+
+    def string(self, value):
+        if "\\" in value:
+            value = ESCAPE_RE.sub(r"\1", value)
+        return value
+
+    def unexpected(self, ch):
+        if not isinstance(ch, str):
+            ch = ch.decode(self.encoding)
+        raise LexerError("unexpected {0} in generic".format(repr(ch)))
+
+    def scan(self, s, pos=0, final=True):
+        """Yields tokens from s starting at pos.
+
+        Unless final is set, stops in front of a token that might continue
+        past the end of s. Either way, self.pos is left at where to resume."""
+        self.pos = pos
+        end = len(s)
+
+        new_token = Token._make
+        integer = self.integer
+        symbol = self.symbol
+        string = self.string
+
+        for match in self.token_re.finditer(s, pos):
+            kind = match.lastindex
+            if kind is None:
+                continue
+
+            self.pos = match.start()
+
+            if kind == 1:
+                yield BRACE_OPEN
+            elif kind == 2:
+                yield BRACE_CLOSE
+            elif kind == 3:
+                if not final and match.end() == end:
+                    return
+                yield new_token(("integer", integer(match.group(3))))
+            elif kind == 4:
+                if not final and match.end() == end:
+                    return
+                yield new_token(("symbol", symbol(match.group(4))))
+            elif kind == 5:
+                yield new_token(("string", string(match.group(5))))
+            elif kind == 6:
+                self.pos = match.start(6)
+                self.unexpected(match.group(6))
+            elif match.group(7) == self.quote:
+                # An unterminated string runs until the end of the buffer.
+                if not final:
+                    return
+                self.pos = end
+                raise LexerError("eof in string")
+            else:
+                self.unexpected(match.group(7))
+
+        self.pos = end
+
+
+# The bytes lexer runs the same expressions over raw ISO-8859-15 data, for
+# example a memory-mapped file. Only string tokens are actually decoded;
+# integers and symbols are pure ASCII and are converted from their slices.
+
+BYTES_TOKEN_RE = re.compile(TOKEN_PATTERN.encode("ascii"), re.VERBOSE | re.DOTALL)
+BYTES_ESCAPE_RE = re.compile(br'\\(.)', re.DOTALL)
+
+KNOWN_SYMBOLS = dict((symbol.encode("ascii"), symbol) for symbol in (
+    "identity",
+    "version",
+    "finances",
+    "fiscal-year",
+    "date",
+    "money",
+    "account-map",
+    "account",
+    "vat",
+    "event",
+))
+
+
+class BytesLexer(FastLexer):
+    """A FastLexer for bytes-like buffers such as mmap objects."""
+
+    token_re = BYTES_TOKEN_RE
+    newline = b"\n"
+    quote = b'"'
+    empty = b""
+
+    @property
+    def linenum(self):
+        # mmap objects have no count(), so slice first.
+        return self.line_base + self.buffer[:self.pos].count(b"\n") + 1
+
+    def decode_chunk(self, chunk, final):
+        if chunk is None:
+            return b""
+        elif isinstance(chunk, str):
+            return chunk.encode(self.encoding)
+        else:
+            return bytes(chunk)
+
+    def integer(self, value):
+        return str(value, "ascii")
+
+    def symbol(self, value):
+        symbol = KNOWN_SYMBOLS.get(value)
+        if symbol is None:
+            symbol = str(value, "ascii")
+        return symbol
+
+    def string(self, value):
+        if b"\\" in value:
+            value = BYTES_ESCAPE_RE.sub(br"\1", value)
+        if b"\r" in value:
+            # Mimic the universal newlines of text mode files.
+            value = value.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+        return str(value, self.encoding)
@@ -24,13 +24,28 @@ Relationships between the classes in pseudo-UML:
 
 Document 1 --> * Account
 Document 1 --> * Event 1 --> * Entry 1 --> Account
+
+Ledgers can have millions of entries, so the classes use __slots__. The
+parsers also let events share equal dates and descriptions, so treat these
+as immutable values: assign a new date instead of modifying one.
+
+A parser asked to keep the source makes SourceEvents, SourceEntries and
+SourceEntryLists, which remember where in the source text the event was.
+Any modification turns them into their plain counterparts, so a writer can
+copy the events that are still unmodified from the source as they were.
 """
 
 
+from array import array
 from datetime import date
 
 import voitto
 
+from .balances import RunningBalances
+from .columns import EntryTable
+from .indexes import AccountIndex, DateIndex
+from .rollup import Rollup
+
 
 DEFAULT_IDENTITY = "Tappio"
 DEFAULT_VERSION = "Voitto " + voitto.__version__
@@ -50,8 +65,21 @@ class Document(object):
     meanings of these trees are associated with the Finnish accounting
     system. The first tree is always "vastaavaa" ("assets"), the second
     is "vastattavaa" ("liabilities") and the third is "earnings" ("tulos").
+
+    A note about derived data:
+
+    Views such as entry_table(), account_index(), date_index(),
+    running_balances() and rollup() are built on first use
+    and cached. They are rebuilt when accounts or events are assigned, the
+    number of events changes or any account tree changes (see
+    Account.generation). After modifying events or entries in place
+    otherwise, call invalidate().
     """
 
+    __slots__ = ('identity', 'version', 'name', 'begin', 'end', '_accounts',
+        '_events', '_entry_table', '_account_index', '_date_index',
+        '_running_balances', '_rollup')
+
     def __init__(self, identity=DEFAULT_IDENTITY, version=DEFAULT_VERSION,
             name="", begin=DEFAULT_BEGIN, end=DEFAULT_END, accounts=None,
             events=None):
@@ -63,8 +91,97 @@ class Document(object):
         self.accounts = accounts if accounts is not None else []
         self.events = events if events is not None else []
 
+    @property
+    def accounts(self):
+        return self._accounts
+
+    @accounts.setter
+    def accounts(self, accounts):
+        self._accounts = AccountList(accounts)
+        self.invalidate()
+
+    @property
+    def events(self):
+        return self._events
+
+    @events.setter
+    def events(self, events):
+        self._events = events
+        self.invalidate()
+
+    def invalidate(self):
+        """Drops the cached views of the document."""
+        self._entry_table = None
+        self._account_index = None
+        self._date_index = None
+        self._running_balances = None
+        self._rollup = None
+
+    def entry_table(self):
+        """Returns the entries of the document as an EntryTable."""
+        table = self._entry_table
+        if table is None or table.num_events != len(self._events):
+            table = self._entry_table = EntryTable(self._events)
+        return table
+
+    def account_index(self):
+        """Returns an AccountIndex of the account tree."""
+        # Kept with the account generation it was built at.
+        if self._account_index is None or self._account_index[0] != Account.generation:
+            self._account_index = (Account.generation, AccountIndex(self._accounts))
+        return self._account_index[1]
+
+    def date_index(self):
+        """Returns a DateIndex of the events."""
+        index = self._date_index
+        if index is None or len(index) != len(self._events):
+            index = self._date_index = DateIndex(self._events)
+        return index
+
+    def events_between(self, from_date=None, to_date=None):
+        """Returns the events dated from from_date to to_date, both inclusive,
+        as a read-only view ordered by (date, number)."""
+        return self.date_index().between(self._events, from_date, to_date)
+
+    def running_balances(self):
+        """Returns the RunningBalances of the accounts."""
+        balances = self._running_balances
+        if balances is None or len(balances) != len(self._events):
+            balances = self._running_balances = RunningBalances(self.events_between())
+        return balances
+
+    def rollup(self):
+        """Returns the Rollup of the account totals."""
+        # Kept with the entry table and the account index it was built from,
+        # so that it is rebuilt along with them.
+        table = self.entry_table()
+        index = self.account_index()
+        if self._rollup is None or self._rollup[0] is not table or self._rollup[1] is not index:
+            self._rollup = (table, index, Rollup(index, table.sum_by_account()))
+        return self._rollup[2]
+
 
 class Account(object):
+    """An account or a group of accounts (with number None).
+
+    Changing the number or the subaccounts of any account, including
+    changes to the subaccount lists themselves, counts up generation, so
+    that indexes of account trees can tell that they are out of date."""
+
+    __slots__ = ('number', 'name', 'vat_type', 'vat_percent', 'subaccounts')
+
+    generation = 0
+
+    def __setattr__(self, name, value):
+        if name == 'subaccounts':
+            value = AccountList(value)
+        elif name != 'number':
+            object.__setattr__(self, name, value)
+            return
+
+        object.__setattr__(self, name, value)
+        Account.generation += 1
+
     def __init__(self, number=None, name="", subaccounts=None, vat_type=None, vat_percent=None):
         self.number = number
         self.name = name
@@ -73,7 +190,32 @@ class Account(object):
         self.subaccounts = subaccounts if subaccounts is not None else []
 
 
+class AccountList(list):
+    """A list of accounts that counts up Account.generation when modified."""
+
+    __slots__ = ()
+
+
+def make_notifying(name):
+    method = getattr(list, name)
+
+    def notify(self, *args, **kwargs):
+        Account.generation += 1
+        return method(self, *args, **kwargs)
+
+    notify.__name__ = name
+    return notify
+
+
+for name in ('__setitem__', '__delitem__', '__iadd__', '__imul__', 'append', 'extend',
+        'insert', 'pop', 'remove', 'clear', 'sort', 'reverse'):
+    setattr(AccountList, name, make_notifying(name))
+del name
+
+
 class Event(object):
+    __slots__ = ('number', 'date', 'description', 'entries', '_source', '_index')
+
     def __init__(self, number, date, description="", entries=None):
         self.number = number
         self.date = date
@@ -82,6 +224,130 @@ class Event(object):
 
 
 class Entry(object):
+    __slots__ = ('account_number', 'cents')
+
     def __init__(self, account_number, cents):
         self.account_number = account_number
         self.cents = cents
+
+
+class Source(object):
+    """The buffer that events were parsed from, and the start and end offset
+    of each event in it."""
+
+    __slots__ = ('buffer', 'encoding', 'starts', 'ends')
+
+    def __init__(self, buffer, encoding):
+        self.buffer = buffer
+        self.encoding = encoding
+        self.starts = array("q")
+        self.ends = array("q")
+
+    def add(self, start, end):
+        """Records the span of an event and returns its index."""
+        self.starts.append(start)
+        self.ends.append(end)
+        return len(self.starts) - 1
+
+    def text(self, index):
+        """Returns the source text of an event, or None if the buffer has
+        been closed."""
+        if self.buffer is None:
+            return None
+
+        text = self.buffer[self.starts[index]:self.ends[index]]
+        if not isinstance(text, str):
+            text = text.decode(self.encoding)
+        return text.lstrip(" \t\r\n")
+
+    def copy(self, index, other):
+        """Appends the text of an event to other, a Source with a bytearray
+        buffer, and returns its index there."""
+        text = self.buffer[self.starts[index]:self.ends[index]]
+        if isinstance(text, str):
+            text = text.encode(other.encoding)
+
+        start = len(other.buffer)
+        other.buffer += text
+        return other.add(start, len(other.buffer))
+
+    def close(self):
+        self.buffer = None
+
+
+def unmodified(cls):
+    """Makes cls the class of the object before setting an attribute."""
+    def __setattr__(self, name, value):
+        object.__setattr__(self, "__class__", cls)
+        object.__setattr__(self, name, value)
+    return __setattr__
+
+
+class SourceEvent(Event):
+    """An Event that has not been modified since it was parsed."""
+
+    __slots__ = ()
+
+    __setattr__ = unmodified(Event)
+
+    @classmethod
+    def attach(cls, event, source, index):
+        event._source = source
+        event._index = index
+        event.__class__ = cls
+        return event
+
+    def source_text(self):
+        """Returns the source text of the event, or None if the event or its
+        entries have been modified since."""
+        entries = self.entries
+        if type(entries) is not SourceEntryList:
+            return None
+
+        for entry in entries:
+            if type(entry) is not SourceEntry:
+                return None
+
+        return self._source.text(self._index)
+
+    def keep_source(self, source):
+        """Copies the source text of the event to source (see Source.copy),
+        so that it can be written verbatim after its own source is closed."""
+        if self._source.buffer is not None:
+            object.__setattr__(self, "_index", self._source.copy(self._index, source))
+            object.__setattr__(self, "_source", source)
+
+
+class SourceEntry(Entry):
+    """An Entry that has not been modified since it was parsed."""
+
+    __slots__ = ()
+
+    __setattr__ = unmodified(Entry)
+
+
+class EntryList(list):
+    __slots__ = ()
+
+
+class SourceEntryList(EntryList):
+    """The entries of a SourceEvent. Becomes an EntryList when modified."""
+
+    __slots__ = ()
+
+
+def make_modifying(name):
+    method = getattr(list, name)
+
+    def modify(self, *args, **kwargs):
+        self.__class__ = EntryList
+        return method(self, *args, **kwargs)
+
+    modify.__name__ = name
+    return modify
+
+
+for name in ('__setitem__', '__delitem__', '__iadd__', '__imul__', 'append', 'extend',
+        'insert', 'pop', 'remove', 'clear', 'sort', 'reverse'):
+    setattr(SourceEntryList, name, make_modifying(name))
+del name
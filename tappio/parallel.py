@@ -0,0 +1,142 @@
+# Voitto - a simple yet efficient double ledger bookkeeping system
+# Copyright (C) 2010 Santtu Pajukanta <santtu@pajukanta.fi>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+"""
+Parsing and writing the event list of a large document on multiple processes.
+"""
+
+
+import marshal
+import os
+import sys
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from .compact import pack_event, pack_events, unpack_event, unpack_events
+from .lexer import ENCODING
+from .models import SourceEvent
+from .parser import FastParser, Mismatch
+from .writer import FastWriter, DEFAULT_INDENT, DEFAULT_BUFFER_SIZE
+
+
+DEFAULT_CHUNK_SIZE = 5000
+
+
+def parse_chunk(data, starts, ends, encoding=ENCODING):
+    """Parses the events at the given offsets of data. Runs in a worker.
+
+    The events are returned packed, which is much cheaper to send back to
+    the parent process than pickled Event objects."""
+    parser = FastParser(data, encoding)
+    return pack_events(parser.parse_event_at(start, end) for start, end in zip(starts, ends))
+
+
+def parse_parallel(buffer, workers=None, chunk_size=DEFAULT_CHUNK_SIZE, encoding=ENCODING):
+    """Parses a buffer like FastParser, but splits the events into chunks of
+    chunk_size events that are parsed by a pool of worker processes.
+
+    workers defaults to the number of CPUs."""
+    parser = FastParser(buffer, encoding)
+
+    try:
+        document = parser.parse_header()
+        starts, ends = parser.scan_events()
+        parser.parse_footer()
+    except Mismatch:
+        return parser.parse_reference()
+
+    with ProcessPoolExecutor(workers) as executor:
+        futures = []
+
+        for first in range(0, len(starts), chunk_size):
+            last = min(first + chunk_size, len(starts)) - 1
+            base = starts[first]
+
+            futures.append(executor.submit(parse_chunk,
+                buffer[base:ends[last]],
+                [start - base for start in starts[first:last + 1]],
+                [end - base for end in ends[first:last + 1]],
+                encoding,
+            ))
+
+        for future in futures:
+            document.events.extend(unpack_events(future.result()))
+
+    return document
+
+
+def render_chunk(data, pretty_print, indent, indent_depth, first):
+    """Renders packed events like FastWriter.render_events. Runs in a worker.
+
+    Events given as strings are already rendered."""
+    writer = FastWriter(None, pretty_print, indent)
+    writer.indent_depth = indent_depth
+    render = writer.event_renderer()
+    separator, next_separator = writer.separators(first)
+
+    dates = {}
+    parts = []
+    for item in marshal.loads(data):
+        parts.append(separator)
+        parts.append(item if isinstance(item, str) else render(unpack_event(item, dates)))
+        separator = next_separator
+    return "".join(parts)
+
+
+class ParallelWriter(FastWriter):
+    """A FastWriter that renders the events in chunks of chunk_size events
+    on a pool of worker processes. The output is identical.
+
+    workers defaults to the number of CPUs. At most two chunks per worker
+    are in flight at a time, so events can come from an iterator."""
+
+    def __init__(self, stream=sys.stdout, pretty_print=False, indent=DEFAULT_INDENT,
+            buffer_size=DEFAULT_BUFFER_SIZE, verbatim=False, workers=None,
+            chunk_size=DEFAULT_CHUNK_SIZE):
+        super(ParallelWriter, self).__init__(stream, pretty_print, indent, buffer_size, verbatim)
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+
+    def pack(self, event):
+        text = event.source_text() if self.verbatim and type(event) is SourceEvent else None
+        return text if text is not None else pack_event(event)
+
+    def write_event_texts(self, events):
+        events = iter(events)
+        first = True
+
+        with ProcessPoolExecutor(self.workers) as executor:
+            pending = deque()
+
+            while True:
+                # Each event is packed as it comes; see FastWriter.write_event_texts.
+                chunk = [self.pack(event) for event in islice(events, self.chunk_size)]
+                if not chunk:
+                    break
+
+                pending.append(executor.submit(render_chunk, marshal.dumps(chunk),
+                    self.pretty_print, self.indent, self.indent_depth, first))
+                first = False
+
+                if len(pending) >= 2 * self.workers:
+                    self.emit(pending.popleft().result())
+
+            while pending:
+                self.emit(pending.popleft().result())
@@ -16,9 +16,21 @@
 #
 
 
+import re
+
+from array import array
+from collections import namedtuple
+from contextlib import closing
 from datetime import date
 
-from .models import Document, Account, Event, Entry
+from .lexer import FastLexer, BytesLexer, SYMBOL_CLASS, ENCODING
+from .lazy import LazyEventList
+from .models import Document, Account, Event, Entry, Source, SourceEvent, SourceEntry, SourceEntryList
+
+
+# How many dates, descriptions and account numbers are shared between events
+# while streaming; see Memo.
+STREAMING_MEMO_LIMIT = 1024
 
 
 class ParserError(RuntimeError):
@@ -35,6 +47,10 @@ class Parser(object):
         self.token_iterator = iter(tokens)
         self.next_token = None
 
+        # Events share equal dates and descriptions.
+        self.dates = Memo(lambda key: date(int(key[0]), int(key[1]), int(key[2])))
+        self.descriptions = Memo(lambda description: description)
+
     def error(self, message, *args, **kwargs):
         raise ParserError(message.format(*args, **kwargs))
 
@@ -52,7 +68,7 @@ class Parser(object):
             self.error("expected {0}, got {1}", expected_type, token.token_type)
 
         if expected_value is not None and expected_value != token.value:
-            self.error("{0}: expected {1}, got {2}", token_type, expected_value, token.value)
+            self.error("{0}: expected {1}, got {2}", token.token_type, expected_value, token.value)
 
         return token.token_type, token.value
 
@@ -72,6 +88,31 @@ class Parser(object):
             return token.token_type, token.value
 
     def parse_document(self):
+        self.parse_header()
+        self.parse_events()
+        self.parse_footer()
+
+        return self.document
+
+    def iterparse(self):
+        """Yields the header as a Document without events, then each Event.
+
+        The events are not collected into the document, so a ledger of any
+        size can be processed in constant memory."""
+        self.limit_memos(STREAMING_MEMO_LIMIT)
+        yield self.parse_header()
+
+        for event in self.iter_events():
+            yield event
+
+        self.parse_footer()
+
+    def limit_memos(self, limit):
+        """Bounds the values shared between events, for when the events are
+        not kept."""
+        self.dates.limit = self.descriptions.limit = limit
+
+    def parse_header(self):
         self.token("brace_open")
         self.token("symbol", "identity")
         unused, self.document.identity = self.token("string", "Tappio")
@@ -81,13 +122,6 @@ class Parser(object):
 
         self.token("symbol", "finances")
 
-        self.parse_fiscal_year()
-
-        self.token("brace_close")
-
-        return self.document
-
-    def parse_fiscal_year(self):
         self.token("brace_open")
 
         self.token("symbol", "fiscal-year")
@@ -97,8 +131,14 @@ class Parser(object):
         self.document.end = self.parse_date()
 
         self.parse_account_map()
-        self.parse_events()
 
+        return self.document
+
+    def parse_footer(self):
+        # fiscal-year
+        self.token("brace_close")
+
+        # identity
         self.token("brace_close")
 
     def parse_date(self):
@@ -111,7 +151,7 @@ class Parser(object):
 
         self.token("brace_close")
 
-        return date(int(year), int(month), int(day))
+        return self.dates[year, month, day]
 
     def parse_money(self):
         self.token("brace_open")
@@ -176,11 +216,19 @@ class Parser(object):
         return Account(account_number, account_name, subaccounts, vat_type, vat_percent)
 
     def parse_events(self):
+        self.document.events.extend(self.iter_events())
+
+    def iter_events(self):
         self.token("brace_open")
 
+        for event in self.iter_more_events():
+            yield event
+
+    def iter_more_events(self):
+        """Like iter_events, but starts after the opening brace."""
         next_type, unused = self.peek()
         while next_type == "brace_open":
-            self.parse_event()
+            yield self.parse_event()
             next_type, unused = self.peek()
 
         self.token("brace_close")
@@ -193,6 +241,7 @@ class Parser(object):
         unused, number = self.token("integer")
         date = self.parse_date()
         unused, description = self.token("string")
+        description = self.descriptions[description]
 
         entries = []
         next_type, unused = self.peek()
@@ -208,8 +257,7 @@ class Parser(object):
 
         self.token("brace_close")
 
-        event = Event(int(number), date, description, entries)
-        self.document.events.append(event)
+        return Event(int(number), date, description, entries)
 
     def parse_entry(self):
         self.token("brace_open")
@@ -220,3 +268,308 @@ class Parser(object):
         self.token("brace_close")
 
         return Entry(int(account_number), cents)
+
+
+# The fast parser matches whole events with a single expression over the raw
+# buffer. It only understands the usual shape of the event list; anything
+# else, errors included, is handed over to Parser, so the result and the
+# error messages are always the same as with the reference implementation.
+
+FAST_PATTERNS = dict(
+    ws=r"[ \t\r\n]*",
+    sep=r"[ \t\r\n]+",
+    end=r"(?![{0}])".format(SYMBOL_CLASS),
+)
+
+EVENT_PATTERN = r"""
+    {ws} \( {ws} event{end} {ws} (-?[0-9]+) {ws}                          # 1: number
+    \( {ws} date{end} {ws} ([0-9]+) {sep} ([0-9]+) {sep} ([0-9]+) {ws} \)  # 2-4: date
+    {ws} "((?:[^"\\]|\\.)*)" {ws}                                        # 5: description
+    (?:
+        (\(                                                               # 6: entries
+            (?: {ws} \( {ws} -?[0-9]+ {ws} \( {ws} money{end} {ws} -?[0-9]+ {ws} \) {ws} \) )*
+        {ws} \)) {ws}
+    )?
+    \)
+""".format(**FAST_PATTERNS)
+
+ENTRY_PATTERN = r"""
+    (-?[0-9]+) {ws} \( {ws} money{end} {ws} (-?[0-9]+)
+""".format(**FAST_PATTERNS)
+
+EVENTS_OPEN_PATTERN = r"{ws}\(".format(**FAST_PATTERNS)
+EVENTS_CLOSE_PATTERN = r"{ws}\){ws}\){ws}\)".format(**FAST_PATTERNS)
+
+# For finding event boundaries without parsing: a form nested at most four
+# levels deep, which covers the usual events. Failing that, the next form in
+# the event list, and the braces within it outside of strings.
+STRING_PATTERN = r'"(?:[^"\\]|\\.)*"'
+
+
+def nested_form_pattern(depth):
+    inner = ""
+    for i in range(depth):
+        inner = r'\((?:[^()"]|{0}{1})*\)'.format(STRING_PATTERN, "|" + inner if inner else "")
+    return inner
+
+
+SHALLOW_FORM_PATTERN = r"{ws}({form})".format(form=nested_form_pattern(4), **FAST_PATTERNS)
+NEXT_FORM_PATTERN = r"{ws}(?:(\()|(\)))".format(**FAST_PATTERNS)
+BRACE_PATTERN = r"""(\()|(\))|{0}|(")""".format(STRING_PATTERN)
+
+FastPatterns = namedtuple("FastPatterns",
+    "event entry events_open events_close shallow_form next_form brace")
+
+
+def compile_fast_patterns(encode):
+    def compile(pattern):
+        return re.compile(encode(pattern), re.VERBOSE | re.DOTALL)
+
+    return FastPatterns(
+        event=compile(EVENT_PATTERN),
+        entry=compile(ENTRY_PATTERN),
+        events_open=compile(EVENTS_OPEN_PATTERN),
+        events_close=compile(EVENTS_CLOSE_PATTERN),
+        shallow_form=compile(SHALLOW_FORM_PATTERN),
+        next_form=compile(NEXT_FORM_PATTERN),
+        brace=compile(BRACE_PATTERN),
+    )
+
+
+STR_FAST_PATTERNS = compile_fast_patterns(lambda pattern: pattern)
+BYTES_FAST_PATTERNS = compile_fast_patterns(lambda pattern: pattern.encode("ascii"))
+
+
+class Memo(dict):
+    """A dict that computes and keeps the values of missing keys.
+
+    With a limit, the dict is emptied when it gets full, so that it holds
+    at most that many recently used values."""
+
+    def __init__(self, function, limit=None):
+        self.function = function
+        self.limit = limit
+
+    def __missing__(self, key):
+        if self.limit is not None and len(self) >= self.limit:
+            self.clear()
+        value = self[key] = self.function(key)
+        return value
+
+
+class Mismatch(Exception):
+    """Raised when FastParser has to hand over to Parser."""
+    pass
+
+
+class FastParser(object):
+    """A parser for a whole Tappio buffer, str or bytes-like.
+
+    Takes in a buffer and makes a Document from it. Equivalent to feeding
+    the buffer through FastLexer or BytesLexer into Parser, only faster.
+
+    With keep_source=True, the events are SourceEvents that remember their
+    span in the buffer; see tappio.models.Source. The buffer must then stay
+    unchanged for as long as the events are written out verbatim."""
+
+    def __init__(self, buffer, encoding=ENCODING, keep_source=False):
+        self.buffer = buffer
+
+        if isinstance(buffer, str):
+            self.lexer = FastLexer(encoding)
+            self.patterns = STR_FAST_PATTERNS
+        else:
+            self.lexer = BytesLexer(encoding)
+            self.patterns = BYTES_FAST_PATTERNS
+
+        self.document = None
+        self.pos = 0
+        self.events_opened = False
+        self.source = Source(buffer, encoding) if keep_source else None
+
+        # Keyed by the raw text, so that repeated values are not even decoded.
+        self.dates = Memo(lambda key: date(int(key[0]), int(key[1]), int(key[2])))
+        self.descriptions = Memo(self.lexer.string)
+        self.account_numbers = Memo(int)
+
+    def limit_memos(self, limit):
+        self.dates.limit = self.descriptions.limit = self.account_numbers.limit = limit
+
+    def parse_document(self):
+        try:
+            self.parse_header()
+            self.document.events.extend(self.iter_events())
+            self.parse_footer()
+        except Mismatch:
+            return self.parse_reference()
+
+        return self.document
+
+    def parse_reference(self):
+        lexer = self.lexer.__class__(self.lexer.encoding)
+        with closing(lexer.lex_string(self.buffer)) as tokens:
+            return Parser(tokens).parse_document()
+
+    def parse_header(self):
+        """Parses everything up to the event list with Parser."""
+        with closing(self.lexer.lex_string(self.buffer)) as tokens:
+            parser = Parser(tokens)
+            self.document = parser.parse_header()
+
+            # The closing brace of the account map was the last token read.
+            self.pos = self.lexer.pos + 1
+
+        return self.document
+
+    def parse_footer(self):
+        if self.patterns.events_close.match(self.buffer, self.pos) is None:
+            raise Mismatch()
+
+    def iterparse(self):
+        """Yields the header and then each event, like Parser.iterparse.
+
+        Where the fast path gives up, Parser carries on from that point, so
+        the events already yielded stand."""
+        self.limit_memos(STREAMING_MEMO_LIMIT)
+        yield self.parse_header()
+
+        try:
+            for event in self.iter_events():
+                yield event
+            self.parse_footer()
+        except Mismatch:
+            for event in self.iter_reference_events():
+                yield event
+
+    def iter_reference_events(self):
+        lexer = self.lexer.__class__(self.lexer.encoding)
+        with closing(lexer.lex_string(self.buffer[self.pos:])) as tokens:
+            parser = Parser(tokens)
+            parser.limit_memos(self.descriptions.limit)
+            events = parser.iter_more_events() if self.events_opened else parser.iter_events()
+            for event in events:
+                yield event
+            parser.parse_footer()
+
+    def parse_lazy_document(self):
+        """Parses the header and locates the events without parsing them.
+
+        The events of the returned document are decoded on first access."""
+        try:
+            self.parse_header()
+            starts, ends = self.scan_events()
+            self.parse_footer()
+        except Mismatch:
+            return self.parse_reference()
+
+        self.document.events = LazyEventList(self, starts, ends)
+        return self.document
+
+    def iter_events(self):
+        buffer = self.buffer
+
+        match = self.patterns.events_open.match(buffer, self.pos)
+        if match is None:
+            raise Mismatch()
+
+        pos = self.pos = match.end()
+        self.events_opened = True
+        match_event = self.patterns.event.match
+        make_event = self.make_event
+
+        while True:
+            match = match_event(buffer, pos)
+            if match is None:
+                break
+
+            pos = self.pos = match.end()
+            event = make_event(match)
+            if self.source is not None:
+                self.attach_source(event, match.start(), pos)
+            yield event
+
+        self.pos = pos
+
+    def make_event(self, match):
+        if match.start(6) >= 0:
+            account_numbers = self.account_numbers
+            entries = [Entry(account_numbers[account_number], int(cents)) for account_number, cents
+                in self.patterns.entry.findall(self.buffer, match.start(6), match.end(6))]
+        else:
+            entries = []
+
+        return Event(int(match.group(1)), self.dates[match.group(2, 3, 4)],
+            self.descriptions[match.group(5)], entries)
+
+    def attach_source(self, event, start, end):
+        for entry in event.entries:
+            entry.__class__ = SourceEntry
+        event.entries = SourceEntryList(event.entries)
+        return SourceEvent.attach(event, self.source, self.source.add(start, end))
+
+    def scan_events(self):
+        """Returns the start and end offsets of each event in the event list."""
+        buffer = self.buffer
+
+        match = self.patterns.events_open.match(buffer, self.pos)
+        if match is None:
+            raise Mismatch()
+
+        pos = match.end()
+        shallow_form = self.patterns.shallow_form.match
+        next_form = self.patterns.next_form.match
+        find_braces = self.patterns.brace.finditer
+        starts = array("q")
+        ends = array("q")
+
+        while True:
+            match = shallow_form(buffer, pos)
+            if match is not None:
+                pos = match.end()
+                starts.append(match.start(1))
+                ends.append(pos)
+                continue
+
+            match = next_form(buffer, pos)
+            if match is None:
+                raise Mismatch()
+            elif match.lastindex == 2:
+                # End of the event list
+                self.pos = match.start(2)
+                return starts, ends
+
+            start = match.start(1)
+            depth = 0
+
+            for match in find_braces(buffer, start):
+                kind = match.lastindex
+                if kind == 1:
+                    depth += 1
+                elif kind == 2:
+                    depth -= 1
+                    if depth == 0:
+                        break
+                elif kind == 3:
+                    # Unterminated string
+                    raise Mismatch()
+            else:
+                raise Mismatch()
+
+            pos = match.end()
+            starts.append(start)
+            ends.append(pos)
+
+    def parse_event_at(self, start, end):
+        """Parses the event found by scan_events at the given offsets."""
+        match = self.patterns.event.match(self.buffer, start)
+        if match is not None and match.end() == end:
+            event = self.make_event(match)
+        else:
+            # Not the usual shape, let Parser deal with it.
+            lexer = self.lexer.__class__(self.lexer.encoding)
+            with closing(lexer.lex_string(self.buffer[start:end])) as tokens:
+                event = Parser(tokens).parse_event()
+
+        if self.source is not None:
+            self.attach_source(event, start, end)
+        return event
@@ -0,0 +1,106 @@
+# Voitto - a simple yet efficient double ledger bookkeeping system
+# Copyright (C) 2010 Santtu Pajukanta <santtu@pajukanta.fi>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+
+"""
+Account movements and balances for every month or quarter of a fiscal year.
+"""
+
+
+from collections import namedtuple
+from datetime import date, timedelta
+
+from .balances import RunningBalances
+
+
+MONTH = "month"
+QUARTER = "quarter"
+
+PERIOD_MONTHS = {
+    MONTH: 1,
+    QUARTER: 3,
+}
+
+
+Period = namedtuple("Period", "label begin end")
+
+
+def period_label(begin, by):
+    if by == QUARTER:
+        return "{0}Q{1}".format(begin.year, (begin.month - 1) // 3 + 1)
+    return "{0}-{1:02d}".format(begin.year, begin.month)
+
+
+def split_periods(begin, end, by=MONTH):
+    """Splits the dates from begin to end, both inclusive, into calendar
+    months or quarters. The first and last periods may be partial."""
+    months = PERIOD_MONTHS[by]
+    periods = []
+
+    period_begin = begin
+    while period_begin <= end:
+        # The first day of the next period, counted in months since year 0.
+        month = (period_begin.year * 12 + period_begin.month - 1) // months * months + months
+        next_begin = date(month // 12, month % 12 + 1, 1)
+        period_end = min(end, next_begin - timedelta(days=1))
+
+        periods.append(Period(period_label(period_begin, by), period_begin, period_end))
+        period_begin = next_begin
+
+    return periods
+
+
+class PeriodReport(object):
+    """Collects the movement of each account in each period in one pass
+    over the events, on top of RunningBalances.
+
+    Events before the first period count towards the opening balances, and
+    events after the last period are ignored."""
+
+    def __init__(self, begin, end, by=MONTH):
+        self.periods = split_periods(begin, end, by)
+        self.begin = begin
+        self.end = end
+        self.balances = RunningBalances()
+
+    def add_event(self, event):
+        if event.date <= self.end:
+            self.balances.add_event(event)
+
+    def add_events(self, events):
+        for event in events:
+            self.add_event(event)
+        return self
+
+    def account_numbers(self):
+        return set(self.balances.totals)
+
+    def opening_of(self, account_number):
+        return self.balances.balance_before(account_number, self.begin)
+
+    def movements_of(self, account_number):
+        balance = self.opening_of(account_number)
+        movements = []
+        for closing in self.balances_of(account_number):
+            movements.append(closing - balance)
+            balance = closing
+        return movements
+
+    def balances_of(self, account_number):
+        """Returns the closing balance of the account for every period."""
+        return [self.balances.balance_at(account_number, period.end) for period in self.periods]
@@ -0,0 +1,78 @@
+# Voitto - a simple yet efficient double ledger bookkeeping system
+# Copyright (C) 2010 Santtu Pajukanta <santtu@pajukanta.fi>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+
+"""
+Totals of every account in the account tree, groups included.
+"""
+
+
+from .indexes import ASSETS, LIABILITIES, EARNINGS
+
+
+class Rollup(object):
+    """The total cents of each account and all of its subaccounts.
+
+    Built from an AccountIndex and the totals of the entries by account
+    number, such as those returned by EntryTable.sum_by_account(). Totals are
+    keyed by the Account objects, as groups have no number."""
+
+    def __init__(self, account_index, cents_by_number):
+        self.account_index = account_index
+        self.totals = dict()
+
+        # The index is in depth-first order, so walking it backwards sees
+        # every subaccount before its parent.
+        totals = self.totals
+        for account in reversed(account_index.order):
+            cents = cents_by_number.get(account.number, 0) if account.number is not None else 0
+            for subaccount in account.subaccounts:
+                cents += totals[subaccount]
+            totals[account] = cents
+
+    def __getitem__(self, account):
+        return self.totals[account]
+
+    def total(self, number):
+        """Returns the total of the account with the given number."""
+        return self.totals[self.account_index[number]]
+
+    def subtree(self, account):
+        """Yields (account, depth, cents) for the account and its
+        subaccounts in depth-first order, depth counted from the account."""
+        stack = [(account, 0)]
+        while stack:
+            account, depth = stack.pop()
+            yield account, depth, self.totals[account]
+
+            for subaccount in reversed(account.subaccounts):
+                stack.append((subaccount, depth + 1))
+
+    def rows(self, *trees):
+        """Yields (account, depth, cents) for the accounts in the given trees,
+        or all of them, in depth-first order."""
+        index = self.account_index
+        for account in index:
+            if not trees or index.tree(account) in trees:
+                yield account, index.depth(account), self.totals[account]
+
+    def balance_sheet(self):
+        return self.rows(ASSETS, LIABILITIES)
+
+    def income_statement(self):
+        return self.rows(EARNINGS)
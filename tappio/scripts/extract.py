@@ -1,11 +1,14 @@
 #!/usr/bin/env python
 
+from argparse import ArgumentParser
 from datetime import date, datetime
+from itertools import chain
 
-from tappio import loadf, dumpf
-from tappio.models import Event, Entry
-
-from .print_earnings import collect_earnings
+from tappio import iterparsef, iterdumpf, source_style
+from tappio.balances import RunningBalances
+from tappio.indexes import ASSETS, LIABILITIES
+from tappio.lexer import ENCODING
+from tappio.models import Event, Entry, Source, SourceEvent
 
 
 BALANCES_DEFAULT_DESCRIPTION = "Tilinavaukset"
@@ -13,72 +16,114 @@ BALANCES_DEFAULT_NUMBER = 0
 DATE_FORMAT = "%Y-%m-%d"
 
 
-def get_balance_accounts(accounts):
-    stack = list()
-    # (vastaavaa, vastattavaa, tulos)
-    stack.extend(accounts[:2])
-    result = set()
+def balances(running_balances, account_numbers, at_date=None, description=BALANCES_DEFAULT_DESCRIPTION,
+        number=BALANCES_DEFAULT_NUMBER):
+    """Returns an event with the balances of the given accounts at the start
+    of at_date as its entries."""
+    if at_date is None:
+        at_date = date.today()
 
-    while stack:
-        cur = stack.pop()
-        if cur.number is not None:
-            result.add(cur.number)
+    result = Event(date=at_date, description=description, number=number)
+    balances = running_balances.balances_before(at_date, account_numbers)
 
-        for subaccount in cur.subaccounts:
-            stack.append(subaccount)
+    for account_number in sorted(balances):
+        result.entries.append(Entry(account_number=account_number, cents=balances[account_number]))
 
     return result
 
 
-def balances(document, at_date=None, description=BALANCES_DEFAULT_DESCRIPTION,
-        number=BALANCES_DEFAULT_NUMBER):
-    if at_date is None:
-        at_date = date.today()
+def select_events(events, running_balances, from_date, to_date):
+    """Reads all events, adding those before from_date to the running
+    balances. Returns the events from from_date to to_date in document
+    order.
 
-    result = Event(date=at_date, description=description, number=number)
-    balances = collect_earnings([i for i in document.events if i.date < at_date])
-    balance_accounts = get_balance_accounts(document.accounts)
+    The events are buffered until the opening balances are known, so their
+    source text is kept along to still write them verbatim."""
+    source = Source(bytearray(), ENCODING)
+    result = []
 
-    for account_number, cents in balances.items():
-        if account_number in balance_accounts:
-            result.entries.append(Entry(account_number=account_number, cents=cents))
+    for event in events:
+        if event.date < from_date:
+            running_balances.add_event(event)
+        elif event.date <= to_date:
+            if type(event) is SourceEvent:
+                event.keep_source(source)
+            result.append(event)
 
     return result
 
 
-def drop_extra_events(document, from_date, to_date):
-    relevant_events = [i for i in document.events if i.date >= from_date
-        and i.date <= to_date]
+def sorted_extracted_events(events, running_balances, account_numbers, from_date, to_date):
+    """Yields the opening balances and then the events from from_date to
+    to_date, as they are read from events sorted by date. Reading stops at
+    the first event after to_date."""
+    events = iter(events)
+
+    for event in events:
+        if event.date < from_date:
+            running_balances.add_event(event)
+        else:
+            break
+    else:
+        event = None
+
+    yield balances(running_balances, account_numbers, from_date)
 
-    document.events = relevant_events
+    if event is None or event.date > to_date:
+        return
+    yield event
 
+    last_date = event.date
+    for event in events:
+        if event.date > to_date:
+            return
+        if event.date < last_date:
+            raise ValueError("the events are not sorted by date")
 
-def inject_balances(document, at_date):
-    balances_event = balances(document, at_date)
-    document.events.insert(0, balances_event)
+        yield event
+        last_date = event.date
 
 
-def extract(from_date_str, to_date_str, input_filename=None, output_filename=None):
+def extract(from_date_str, to_date_str, input_filename=None, output_filename=None,
+        assume_sorted=False):
     from_date = datetime.strptime(from_date_str, DATE_FORMAT).date()
     to_date = datetime.strptime(to_date_str, DATE_FORMAT).date()
 
     if from_date > to_date:
         raise ValueError("from_date > to_date")
 
-    document = loadf(input_filename)
+    items = iterparsef(input_filename, keep_source=True)
+    document = next(items)
+    account_numbers = document.account_index().numbers(ASSETS, LIABILITIES)
+    running_balances = RunningBalances()
 
-    inject_balances(document, from_date)
-    drop_extra_events(document, from_date, to_date)
+    if assume_sorted:
+        events = sorted_extracted_events(items, running_balances, account_numbers, from_date, to_date)
+    else:
+        selected = select_events(items, running_balances, from_date, to_date)
+        events = chain([balances(running_balances, account_numbers, from_date)], selected)
 
     document.begin = from_date
     document.end = to_date
 
-    dumpf(output_filename, document)
+    try:
+        iterdumpf(output_filename, document, events, **source_style(input_filename))
+    finally:
+        items.close()
 
 
 def main():
-    from sys import argv
-    extract(*argv[1:])
+    parser = ArgumentParser(description="Extract a period of time from a TLK file, with opening balances.")
+    parser.add_argument("--sorted", action="store_true", dest="assume_sorted",
+        help="the events are sorted by date, so stop reading after the period")
+    parser.add_argument("from_date", help="YYYY-MM-DD")
+    parser.add_argument("to_date", help="YYYY-MM-DD")
+    parser.add_argument("input_filename", nargs="?")
+    parser.add_argument("output_filename", nargs="?")
+    args = parser.parse_args()
+
+    extract(args.from_date, args.to_date, args.input_filename, args.output_filename,
+        assume_sorted=args.assume_sorted)
 
 
 if __name__ == "__main__":
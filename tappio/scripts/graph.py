@@ -4,7 +4,7 @@
 import sys
 from contextlib import contextmanager
 
-from tappio import loadf
+from tappio import iterparsef
 from voitto.helpers.io import output_stream
 
 GRAPH_HEADER = "digraph X {\n"
@@ -13,23 +13,6 @@ NODE_TEMPLATE = "{0} {1}"
 EDGE_TEMPLATE = '\t"{0}" -> "{1}";\n'
 
 
-def flatten_accounts(accounts):
-    result = dict()
-
-    for account in accounts:
-        recursively_flatten_account(account, result)
-
-    return result
-
-
-def recursively_flatten_account(account, flat_accounts={}):
-    if account.number is not None:
-        flat_accounts[account.number] = account.name
-
-    for subaccount in account.subaccounts:
-        recursively_flatten_account(subaccount, flat_accounts)
-
-
 def print_graph(edges, stream=sys.stdout):
     stream.write(GRAPH_HEADER)
 
@@ -39,7 +22,7 @@ def print_graph(edges, stream=sys.stdout):
     stream.write(GRAPH_FOOTER)
 
 
-def construct_graph(events, flat_accounts):
+def construct_graph(events, account_index):
     edges = set()
 
     for event in events:
@@ -53,10 +36,10 @@ def construct_graph(events, flat_accounts):
                 debet_accounts.add(entry.account_number)
 
         for kredit_account in kredit_accounts:
-            kredit_node = NODE_TEMPLATE.format(kredit_account, flat_accounts[kredit_account])
+            kredit_node = NODE_TEMPLATE.format(kredit_account, account_index[kredit_account].name)
 
             for debet_account in debet_accounts:
-                debet_node = NODE_TEMPLATE.format(debet_account, flat_accounts[debet_account])
+                debet_node = NODE_TEMPLATE.format(debet_account, account_index[debet_account].name)
 
                 edges.add((kredit_node, debet_node))
 
@@ -64,11 +47,11 @@ def construct_graph(events, flat_accounts):
 
 
 def graph(input_filename=None, output_filename=None):
-    document = loadf(input_filename)
-    flat_accounts = flatten_accounts(document.accounts)
-    edges = construct_graph(document.events, flat_accounts)
+    items = iterparsef(input_filename)
+    document = next(items)
+    edges = construct_graph(items, document.account_index())
 
-    with output_stream(output_filename) as stream:
+    with output_stream(output_filename, 'w') as stream:
         print_graph(edges, stream)
 
 
@@ -1,38 +1,155 @@
 #!/usr/bin/env python
 
-from tappio import loadf, dumpf
-from tappio.models import Document
-from functools import reduce
+import sys
 
+from collections import namedtuple
+from heapq import merge as heap_merge
 
-def combine_accounts(earliers, laters):
-    # XXX Seriously fugly hack, do this properly
-    return laters
+from tappio import iterparsef, iterdumpf
+from tappio.indexes import event_sort_key
+from tappio.models import Document, Account, Event, Entry
+from tappio.scripts.renumber import renumbered
 
 
-def combine_events(earliers, laters):
-    return earliers + laters
+Conflict = namedtuple("Conflict", "number field earlier later")
 
 
-def merge_two(earlier, later):
-    d = Document()
-    d.identity = later.identity if later.identity is not None else earlier.identity
-    d.name = later.name if later.name is not None else earlier.identity
-    d.begin = min(earlier.begin, later.begin)
-    d.end = max(earlier.end, later.end)
-    d.accounts = combine_accounts(earlier.accounts, later.accounts)
-    d.events = combine_events(earlier.events, later.events)
-    return d
+class AccountUnion(object):
+    """Merges account forests into one, keyed by account number.
+
+    The first tree of each forest goes under the first merged tree and so
+    on. Groups are matched by name within their parent. An account number
+    seen before is merged into the earlier account; where the name, VAT or
+    parent group differs, the later file wins and a Conflict is recorded."""
+
+    def __init__(self):
+        self.roots = []
+        self.by_number = dict()
+        self.parent_names = dict()
+        self.conflicts = []
+
+    def add_forest(self, accounts):
+        for i, root in enumerate(accounts):
+            if i == len(self.roots):
+                self.roots.append(self.shell(root))
+            self.merge_into(self.roots[i], root)
+        return self.roots
+
+    @staticmethod
+    def shell(account):
+        return Account(account.number, account.name, [], account.vat_type, account.vat_percent)
+
+    def merge_into(self, target, source):
+        for account in source.subaccounts:
+            if account.number is None:
+                merged = self.find_group(target, account.name)
+                if merged is None:
+                    merged = self.shell(account)
+                    target.subaccounts.append(merged)
+            else:
+                merged = self.by_number.get(account.number)
+                if merged is None:
+                    merged = self.by_number[account.number] = self.shell(account)
+                    self.parent_names[account.number] = target.name
+                    target.subaccounts.append(merged)
+                else:
+                    self.update(merged, account, target)
+
+            self.merge_into(merged, account)
+
+    @staticmethod
+    def find_group(parent, name):
+        for account in parent.subaccounts:
+            if account.number is None and account.name == name:
+                return account
+        return None
+
+    def update(self, merged, account, parent):
+        number = account.number
+
+        if merged.name != account.name:
+            self.conflicts.append(Conflict(number, "name", merged.name, account.name))
+            merged.name = account.name
+
+        if (merged.vat_type, merged.vat_percent) != (account.vat_type, account.vat_percent):
+            self.conflicts.append(Conflict(number, "vat", (merged.vat_type, merged.vat_percent),
+                (account.vat_type, account.vat_percent)))
+            merged.vat_type = account.vat_type
+            merged.vat_percent = account.vat_percent
+
+        if self.parent_names[number] != parent.name:
+            # The account stays where it was first seen.
+            self.conflicts.append(Conflict(number, "parent", self.parent_names[number], parent.name))
+
+
+def merge_headers(headers):
+    """Returns a Document without events that combines the headers, and the
+    account conflicts between them. Later headers take precedence."""
+    merged = Document()
+    union = AccountUnion()
+
+    for i, header in enumerate(headers):
+        merged.identity = header.identity
+        merged.name = header.name
+        merged.begin = min(merged.begin, header.begin) if i else header.begin
+        merged.end = max(merged.end, header.end) if i else header.end
+        union.add_forest(header.accounts)
+
+    merged.accounts = union.roots
+    return merged, union.conflicts
+
+
+def merge_events(event_iterables, renumber=True, start=1):
+    """Merges event streams, each sorted by (date, number), into one by
+    (date, number). Ties keep the order of the streams. With renumber, the
+    events are numbered from start in the merged order; the numbers are set
+    on the given events themselves."""
+    merged = heap_merge(*event_iterables, key=event_sort_key)
+
+    if not renumber:
+        return merged
+    return renumbered(merged, start)
+
+
+def copied_events(events):
+    for event in events:
+        entries = [Entry(entry.account_number, entry.cents) for entry in event.entries]
+        yield Event(event.number, event.date, event.description, entries)
 
 
 def merge(*documents):
-    return reduce(merge_two, documents)
+    """Returns a Document that combines the documents. Their events are
+    copied, so the documents are left as they were."""
+    header, conflicts = merge_headers(documents)
+    header.events = list(merge_events([copied_events(document.events) for document in documents]))
+    return header
+
+
+def report_conflicts(conflicts, stream=sys.stderr):
+    for conflict in conflicts:
+        stream.write("account {0}: {1} {2!r} replaced by {3!r}\n".format(*conflict))
+
+
+def checked_order(events, filename, stream=sys.stderr):
+    """Passes the events through, warning once if they are out of order."""
+    previous = None
+    warned = False
+    for event in events:
+        key = event_sort_key(event)
+        if not warned and previous is not None and key < previous:
+            stream.write("{0}: events are not sorted, run tappio-renumber on it first\n".format(filename))
+            warned = True
+        previous = key
+        yield event
 
 
 def merge_files(output_filename, *input_filenames):
-    documents = (loadf(filename) for filename in input_filenames)
-    merged = merge(*documents)
-    dumpf(output_filename, merged)
+    inputs = [iterparsef(filename) for filename in input_filenames]
+    header, conflicts = merge_headers([next(items) for items in inputs])
+    report_conflicts(conflicts)
+
+    events = [checked_order(items, filename) for items, filename in zip(inputs, input_filenames)]
+    iterdumpf(output_filename, header, merge_events(events))
 
 
 def main():
@@ -7,27 +7,11 @@ from tappio import loadf, dumpf
 ONLY=True
 
 
-def flatten_accounts(accounts):
-    flat_accounts = dict()
-
-    for branch in accounts:
-        _flatten_accounts(branch, flat_accounts)
-
-    return flat_accounts
-
-
-def _flatten_accounts(account, accounts):
-    accounts[account.number] = account
-
-    for subaccount in account.subaccounts:
-        _flatten_accounts(subaccount, accounts)
-
-
 def missing_accounts(*input_filenames):
     input_filenames = set(input_filenames)
 
-    documents = ((filename, loadf(filename)) for filename in input_filenames)
-    flat_accounts = dict((filename, flatten_accounts(document.accounts)) for (filename, document) in documents)
+    documents = ((filename, loadf(filename, lazy=True)) for filename in input_filenames)
+    flat_accounts = dict((filename, document.account_index().by_number) for (filename, document) in documents)
 
     all_accounts = dict()
     for account in flat_accounts.values():
@@ -1,26 +1,179 @@
 #!/usr/bin/env python
 
-from tappio import loadf, dumpf
+from argparse import ArgumentParser, SUPPRESS
+from csv import reader
 
+from tappio import iterparsef, iterdumpf, source_style
 
-def move_entries(events, from_account_num, to_account_num):
+
+def moved_entries(events, from_account_num, to_account_num):
     for event in events:
         for entry in event.entries:
             if entry.account_number == from_account_num:
                 entry.account_number = to_account_num
+        yield event
+
+
+def move_entries(events, from_account_num, to_account_num):
+    for event in moved_entries(events, from_account_num, to_account_num):
+        pass
+
+
+def read_mapping(filename):
+    """Reads from,to account number pairs from a CSV file into a dict. A first
+    row that is not numbers is taken to be a header."""
+    mapping = dict()
+
+    with open(filename, newline="") as f:
+        for line_num, row in enumerate(reader(f), start=1):
+            if not row:
+                continue
+
+            try:
+                from_account_num, to_account_num = [int(field) for field in row]
+            except ValueError:
+                if line_num == 1:
+                    continue
+                raise ValueError("%s:%d: expected two account numbers" % (filename, line_num))
+
+            if from_account_num in mapping:
+                raise ValueError("%s:%d: account %d is mapped twice" % (filename, line_num, from_account_num))
+            mapping[from_account_num] = to_account_num
+
+    return mapping
+
+
+def remap_accounts(document, mapping):
+    """Renumbers the accounts in the account map of the document according to
+    mapping. An account mapped to an existing account is merged into it: it
+    is removed and its subaccounts are moved to the other account. If the
+    other account is one of those subaccounts, it takes the place of the
+    removed account.
+
+    Raises ValueError if some account in mapping is not in the account map.
+    Accounts can be renumbered only to numbers that are mapped away."""
+    index = document.account_index()
+
+    missing = sorted(number for number in mapping if number not in index)
+    if missing:
+        raise ValueError("not in the account map: %s" % ", ".join(str(number) for number in missing))
+
+    unknown = sorted(set(number for number in mapping.values() if number not in index))
+    if unknown:
+        raise ValueError("mapped to accounts not in the account map: %s"
+            % ", ".join(str(number) for number in unknown))
+
+    kept = dict((number, account) for (number, account) in index.by_number.items() if number not in mapping)
+    mapped = [account for account in index if account.number in mapping]
+    parents = dict(index.parents)
+
+    def is_descendant(account, ancestor):
+        parent = parents[account]
+        while parent is not None:
+            if parent is ancestor:
+                return True
+            parent = parents[parent]
+        return False
+
+    for account in mapped:
+        number = mapping[account.number]
+        target = kept.get(number)
+
+        if target is None:
+            account.number = number
+            kept[number] = account
+            continue
+
+        parent = parents[account]
+        siblings = parent.subaccounts if parent is not None else document.accounts
+
+        if is_descendant(target, account):
+            parents[target].subaccounts.remove(target)
+            siblings[siblings.index(account)] = target
+            parents[target] = parent
+        else:
+            siblings.remove(account)
+
+        target.subaccounts.extend(account.subaccounts)
+        for subaccount in account.subaccounts:
+            parents[subaccount] = target
+
+
+def merge_entries(event):
+    """Sums the entries of the event that are on the same account into the
+    first one of them."""
+    first_entries = dict()
+    entries = []
+
+    for entry in event.entries:
+        first_entry = first_entries.get(entry.account_number)
+        if first_entry is None:
+            first_entries[entry.account_number] = entry
+            entries.append(entry)
+        else:
+            first_entry.cents += entry.cents
+
+    if len(entries) != len(event.entries):
+        event.entries = entries
+
+
+def remapped_entries(events, mapping, merge=False):
+    """Moves the entries of each account in mapping to the account it maps
+    to. With merge=True, entries that end up on the same account within an
+    event are merged."""
+    get = mapping.get
+
+    for event in events:
+        remapped = False
+        for entry in event.entries:
+            to_account_num = get(entry.account_number)
+            if to_account_num is not None:
+                entry.account_number = to_account_num
+                remapped = True
+
+        if merge and remapped:
+            merge_entries(event)
+        yield event
 
 
 def move_entries_util(from_account_num, to_account_num, input_filename=None, output_filename=None):
     from_account_num = int(from_account_num)
     to_account_num = int(to_account_num)
-    document = loadf(input_filename)
-    move_entries(document.events, from_account_num, to_account_num)
-    dumpf(output_filename, document)
+    items = iterparsef(input_filename, keep_source=True)
+    document = next(items)
+    iterdumpf(output_filename, document, moved_entries(items, from_account_num, to_account_num),
+        **source_style(input_filename))
+
+
+def remap_entries_util(mapping_filename, input_filename=None, output_filename=None, merge=False):
+    mapping = read_mapping(mapping_filename)
+    items = iterparsef(input_filename, keep_source=True)
+    document = next(items)
+    remap_accounts(document, mapping)
+    iterdumpf(output_filename, document, remapped_entries(items, mapping, merge),
+        **source_style(input_filename))
 
 
 def main():
-    from sys import argv
-    move_entries_util(*argv[1:])
+    parser = ArgumentParser(description="Move all entries from one account number to another.",
+        usage="%(prog)s [-h] FROM TO [INPUT [OUTPUT]]\n"
+        "       %(prog)s [-h] --mapping CSV [--merge] [INPUT [OUTPUT]]")
+    parser.add_argument("--mapping", metavar="CSV",
+        help="move the entries of every from,to pair of account numbers in a CSV file in one go, "
+        "merging the accounts in the account map too; both accounts must be in the account map")
+    parser.add_argument("--merge", action="store_true",
+        help="with --mapping, merge the entries of an event that end up on the same account")
+    parser.add_argument("arguments", nargs="*", help=SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mapping is not None:
+        if len(args.arguments) > 2:
+            parser.error("too many arguments")
+        remap_entries_util(args.mapping, *args.arguments, merge=args.merge)
+    else:
+        if not 2 <= len(args.arguments) <= 4:
+            parser.error("expected FROM TO [INPUT [OUTPUT]]")
+        move_entries_util(*args.arguments)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+import json
+
+from argparse import ArgumentParser
+from csv import writer
+
+from tappio import iterparsef
+from tappio.indexes import AccountIndex
+from tappio.periods import PeriodReport, MONTH, PERIOD_MONTHS
+from voitto.helpers.io import output_stream
+
+
+CSV = "csv"
+JSON = "json"
+
+
+def format_cents(cents):
+    sign = "-" if cents < 0 else ""
+    return sign + "%d.%02d" % divmod(abs(cents), 100)
+
+
+def report_accounts(report, account_index):
+    """Returns the numbers and names of the accounts in the report, in the
+    order of the account tree. Unknown accounts come last."""
+    numbers = report.account_numbers()
+    accounts = [(account.number, account.name) for account in account_index
+        if account.number is not None and account.number in numbers]
+    known = set(number for number, name in accounts)
+    accounts.extend((number, "") for number in sorted(numbers - known))
+    return accounts
+
+
+def write_csv(report, accounts, stream):
+    w = writer(stream)
+
+    header = ["account", "name"]
+    for period in report.periods:
+        header.extend([period.label + " movement", period.label + " balance"])
+    w.writerow(header)
+
+    for number, name in accounts:
+        row = [number, name]
+        for cents, balance in zip(report.movements_of(number), report.balances_of(number)):
+            row.extend([format_cents(cents), format_cents(balance)])
+        w.writerow(row)
+
+
+def write_json(report, accounts, stream):
+    # Amounts are in cents.
+    json.dump({
+        "periods": [
+            {"label": period.label, "begin": period.begin.isoformat(), "end": period.end.isoformat()}
+            for period in report.periods
+        ],
+        "accounts": [
+            {
+                "number": number,
+                "name": name,
+                "opening": report.opening_of(number),
+                "movements": report.movements_of(number),
+                "balances": report.balances_of(number),
+            }
+            for number, name in accounts
+        ],
+    }, stream, indent=2)
+    stream.write("\n")
+
+
+WRITERS = {
+    CSV: write_csv,
+    JSON: write_json,
+}
+
+
+def periods(input_filename=None, output_filename=None, by=MONTH, output_format=CSV):
+    items = iterparsef(input_filename)
+    document = next(items)
+    report = PeriodReport(document.begin, document.end, by).add_events(items)
+    accounts = report_accounts(report, AccountIndex(document.accounts))
+
+    with output_stream(output_filename, 'w') as out:
+        WRITERS[output_format](report, accounts, out)
+
+
+def main():
+    parser = ArgumentParser(description="Print the movement and closing balance "
+        "of every account for each period of the fiscal year.")
+    parser.add_argument("--by", choices=sorted(PERIOD_MONTHS), default=MONTH)
+    parser.add_argument("--format", choices=sorted(WRITERS), default=CSV)
+    parser.add_argument("input_filename", nargs="?")
+    parser.add_argument("output_filename", nargs="?")
+    args = parser.parse_args()
+
+    periods(args.input_filename, args.output_filename, args.by, args.format)
+
+
+if __name__ == "__main__":
+    main()
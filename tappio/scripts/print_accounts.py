@@ -1,6 +1,6 @@
 #!/usr/bin/env python
 
-from tappio import loadf
+from tappio import iterparsef
 
 
 def print_accounts(accounts, indent=0, indent_increment=2):
@@ -15,7 +15,12 @@ def print_accounts(accounts, indent=0, indent_increment=2):
 def main():
     from sys import argv
     input_filename = argv[1] if len(argv) >= 2 else None
-    document = loadf(input_filename)
+    # Only the account map is needed, so the events are never read.
+    items = iterparsef(input_filename)
+    try:
+        document = next(items)
+    finally:
+        items.close()
     print_accounts(document.accounts)
 
 
@@ -2,19 +2,26 @@
 
 import sys
 
+from argparse import ArgumentParser
 from csv import writer
 from collections import defaultdict
 
-from tappio import loadf
+from tappio import iterparsef
+from tappio.indexes import AccountIndex
+from tappio.rollup import Rollup
+from voitto.helpers.io import output_stream
 
 def format_money(cents):
     cents = -cents
     return "%d.%02d" % divmod(cents, 100)
 
 
-def print_earnings(earnings_account, earnings, stream=sys.stdout):
+def print_earnings(earnings_account, earnings, stream=sys.stdout, totals=False):
     w = writer(stream)
-    recursively_print_earnings(earnings_account, earnings, w)
+    if totals:
+        print_totals(earnings_account, earnings, w)
+    else:
+        recursively_print_earnings(earnings_account, earnings, w)
 
 
 def recursively_print_earnings(account, earnings, w):
@@ -25,6 +32,14 @@ def recursively_print_earnings(account, earnings, w):
         recursively_print_earnings(subaccount, earnings, w)
 
 
+def print_totals(account, earnings, w):
+    # Groups get an empty account number.
+    rollup = Rollup(AccountIndex([account]), earnings)
+    for account, depth, cents in rollup.subtree(account):
+        number = account.number if account.number is not None else ""
+        w.writerow([number, account.name, format_money(cents)])
+
+
 def collect_earnings(events):
     earnings = defaultdict(int)
 
@@ -35,17 +50,23 @@ def collect_earnings(events):
     return earnings
 
 
-def print_earnings_util(input_filename=None, output_filename=None):
-    input_filename = argv[1] if len(argv) >= 2 else None
-
-    document = loadf(input_filename)
-    earnings = collect_earnings(document.events)
+def print_earnings_util(input_filename=None, output_filename=None, totals=False):
+    items = iterparsef(input_filename)
+    document = next(items)
+    earnings = collect_earnings(items)
 
-    with output_stream(output_filename) as out:
-        print_earnings(document.accounts[2], earnings, out)
+    with output_stream(output_filename, 'w') as out:
+        print_earnings(document.accounts[2], earnings, out, totals)
 
 def main():
-    print_earnings_util(*sys.argv[1:])
+    parser = ArgumentParser(description="Print incomes and expenses in CSV.")
+    parser.add_argument("--totals", action="store_true",
+        help="print groups too, with the totals of their subaccounts")
+    parser.add_argument("input_filename", nargs="?")
+    parser.add_argument("output_filename", nargs="?")
+    args = parser.parse_args()
+
+    print_earnings_util(args.input_filename, args.output_filename, args.totals)
 
 if __name__ == "__main__":
     main()
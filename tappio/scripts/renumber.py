@@ -1,24 +1,44 @@
 #!/usr/bin/env python
 
-from tappio import loadf, dumpf
+import marshal
+
+from argparse import ArgumentParser
+from heapq import merge as heap_merge
+from itertools import chain, islice
+from tempfile import TemporaryFile
+
+from tappio import iterparsef, iterdumpf
+from tappio.compact import pack_event, unpack_event
+from tappio.indexes import event_sort_key
+
+
+# Roughly what a loaded event and each of its entries take in memory; see
+# benchmarks/memory_benchmark.py.
+EVENT_SIZE = 200
+ENTRY_SIZE = 80
+
+DEFAULT_MEMORY_BUDGET = 256 << 20
+
+# Events are written to the sorted runs in blocks of this many events.
+RUN_BLOCK_SIZE = 1000
+
+
+class NotSorted(Exception):
+    pass
 
 
 def sort_events(events):
     events.sort(key=lambda x: (x.date, x.number))
 
 
-def sort_accounts(accounts):
-    assets, liabilities, result = accounts
-    recursively_sort_subaccounts(assets)
-    recursively_sort_subaccounts(liabilities)
-    recursively_sort_subaccounts(result)
-
+def account_sort_key(account):
+    # Groups are written as -1.
+    return account.number if account.number is not None else -1
 
-def recursively_sort_subaccounts(account):
-    account.subaccounts.sort(key=lambda x: x.number)
 
-    for subaccount in account.subaccounts:
-        recursively_sort_subaccounts(subaccount)
+def sort_accounts(document):
+    for account in document.account_index():
+        account.subaccounts.sort(key=account_sort_key)
 
 
 def renumber_events(events, start=1):
@@ -26,17 +46,130 @@ def renumber_events(events, start=1):
         event.number = num
 
 
-def renumber(input_filename=None, output_filename=None):
-    document = loadf(input_filename)
-    sort_accounts(document.accounts)
-    sort_events(document.events)
-    renumber_events(document.events)
-    dumpf(output_filename, document)
+def renumbered(events, start=1):
+    for number, event in enumerate(events, start=start):
+        event.number = number
+        yield event
+
+
+def renumbered_if_sorted(events, start=1):
+    """Like renumbered, but raises NotSorted if the events turn out not to
+    be in (date, number) order."""
+    previous = None
+    for number, event in enumerate(events, start=start):
+        key = event_sort_key(event)
+        if previous is not None and key < previous:
+            raise NotSorted()
+        previous = key
+
+        event.number = number
+        yield event
+
+
+def write_run(events):
+    """Sorts the events into a temporary file and returns the file."""
+    sort_events(events)
+    run = TemporaryFile()
+    for first in range(0, len(events), RUN_BLOCK_SIZE):
+        marshal.dump([pack_event(event) for event in islice(events, first, first + RUN_BLOCK_SIZE)], run)
+    return run
+
+
+def read_run(run):
+    run.seek(0)
+    dates = {}
+    while True:
+        try:
+            block = marshal.load(run)
+        except EOFError:
+            return
+        for packed in block:
+            yield unpack_event(packed, dates)
+
+
+def external_sort(events, memory_budget=DEFAULT_MEMORY_BUDGET):
+    """Yields the events sorted by (date, number), holding about
+    memory_budget bytes of them in memory at a time.
+
+    Events beyond the budget are sorted into runs in temporary files, which
+    are then merged. If all events fit, they are simply sorted. Events that
+    turn out to be sorted already are passed on in order, from the runs one
+    after another if there are any."""
+    runs = []
+    buffer = []
+    size = 0
+    in_order = True
+    last_key = None
+
+    for event in events:
+        if in_order:
+            key = event_sort_key(event)
+            if last_key is not None and key < last_key:
+                in_order = False
+            last_key = key
+
+        buffer.append(event)
+        size += EVENT_SIZE + ENTRY_SIZE * len(event.entries)
+        if size >= memory_budget:
+            runs.append(write_run(buffer))
+            buffer = []
+            size = 0
+
+    if not runs:
+        if not in_order:
+            sort_events(buffer)
+        for event in buffer:
+            yield event
+        return
+
+    if buffer:
+        runs.append(write_run(buffer))
+    del buffer
+
+    try:
+        if in_order:
+            merged = chain.from_iterable(read_run(run) for run in runs)
+        else:
+            merged = heap_merge(*[read_run(run) for run in runs], key=event_sort_key)
+
+        for event in merged:
+            yield event
+    finally:
+        for run in runs:
+            run.close()
+
+
+def renumber(input_filename=None, output_filename=None, memory_budget=DEFAULT_MEMORY_BUDGET):
+    items = iterparsef(input_filename)
+    document = next(items)
+    sort_accounts(document)
+
+    if input_filename is not None and output_filename is not None:
+        # Sorted input needs only renumbering in one streaming pass. The
+        # output is only put in place if the input was sorted all along.
+        try:
+            iterdumpf(output_filename, document, renumbered_if_sorted(items))
+            return
+        except NotSorted:
+            items.close()
+
+        items = iterparsef(input_filename)
+        next(items)
+
+    iterdumpf(output_filename, document, renumbered(external_sort(items, memory_budget)))
 
 
 def main():
-    from sys import argv
-    renumber(*argv[1:])
+    parser = ArgumentParser(description="Sort and renumber events by date.",
+        epilog="Sorted input is renumbered in a single pass when both files are given. Otherwise "
+        "the events are held in memory, and beyond --memory in temporary files, until all are read.")
+    parser.add_argument("--memory", type=int, default=DEFAULT_MEMORY_BUDGET >> 20, metavar="MB",
+        help="how much memory to use for sorting before using temporary files")
+    parser.add_argument("input_filename", nargs="?")
+    parser.add_argument("output_filename", nargs="?")
+    args = parser.parse_args()
+
+    renumber(args.input_filename, args.output_filename, args.memory << 20)
 
 
 if __name__ == "__main__":
@@ -20,12 +20,23 @@ import sys
 
 import voitto
 
+from .models import SourceEvent
+
 DEFAULT_IDENTITY = "Tappio"
 DEFAULT_BEGIN = datetime.date(2010, 1, 1)
 DEFAULT_END = datetime.date(2010, 12, 31)
 
 DEFAULT_INDENT = "  "
 
+# FastWriter writes its output in blocks of about this many characters.
+DEFAULT_BUFFER_SIZE = 1 << 16
+
+ESCAPES = str.maketrans({
+    '\n': r'\n',
+    '"': r'\"',
+    '\\': r'\\',
+})
+
 class Writer(object):
     def __init__(self, stream=sys.stdout, pretty_print=False, indent=DEFAULT_INDENT):
         self.stream = stream
@@ -88,6 +99,14 @@ class Writer(object):
             return ch
 
     def write_document(self, document):
+        self.write_header(document)
+        self.write_events(document.events)
+        self.write_footer()
+
+    def write_header(self, document):
+        """Writes everything before the events. The events of the document
+        are not used, so they can be written from any iterable with
+        write_events() and followed by write_footer()."""
         self.write("(", "identity")
         self.write_string(document.identity)
 
@@ -106,8 +125,8 @@ class Writer(object):
         self.new_line(1)
         self.write_accounts(document.accounts)
         self.new_line()
-        self.write_events(document.events)
 
+    def write_footer(self):
         self.new_line(-1)
         self.write(")")
         self.new_line(-1)
@@ -183,3 +202,136 @@ class Writer(object):
         self.write("(", entry.account_number)
         self.write_money(entry.cents)
         self.write(")")
+
+
+class FastWriter(Writer):
+    """A Writer that renders whole events at a time and writes in blocks.
+
+    The output is identical to that of Writer. The header and the account
+    map go through the token-by-token machinery of Writer, but into a
+    buffer instead of the stream.
+
+    With verbatim=True, events that are unmodified since they were parsed
+    with keep_source=True are copied from the source text instead. Their
+    formatting is then kept as it was in the source."""
+
+    def __init__(self, stream=sys.stdout, pretty_print=False, indent=DEFAULT_INDENT,
+            buffer_size=DEFAULT_BUFFER_SIZE, verbatim=False):
+        super(FastWriter, self).__init__(stream, pretty_print, indent)
+        self.buffer_size = buffer_size
+        self.verbatim = verbatim
+        self.parts = []
+        self.buffered = 0
+
+    def emit(self, text):
+        self.parts.append(text)
+        self.buffered += len(text)
+        if self.buffered >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        self.stream.write("".join(self.parts))
+        self.parts = []
+        self.buffered = 0
+
+    def write(self, *tokens):
+        if self.new_line_queued:
+            self.actually_write_newline()
+
+        for token in tokens:
+            if self.should_put_space_between(self.prev_token, token):
+                self.emit(" ")
+            self.emit(str(token))
+
+            self.prev_token = token
+
+    def actually_write_newline(self):
+        if self.pretty_print:
+            self.emit("\r\n" + self.indent * self.indent_depth)
+            self.new_line_queued = False
+            self.prev_token = None
+
+    def escape_string(self, string):
+        return string.translate(ESCAPES)
+
+    def write_footer(self):
+        super(FastWriter, self).write_footer()
+        self.flush()
+
+    def write_events(self, events):
+        self.write("(")
+        self.new_line(1)
+
+        self.write_event_texts(events)
+
+        # Leave the state as Writer would after writing the events.
+        self.prev_token = ")"
+        self.new_line_queued = True
+
+        self.new_line(-1)
+        self.write(")")
+
+    def write_event_texts(self, events):
+        # Events are rendered as they come, as their source may go away
+        # when the iterator moves on; see iterparsef.
+        render = self.event_renderer()
+        separator, next_separator = self.separators(first=True)
+        for event in events:
+            self.emit(separator + render(event))
+            separator = next_separator
+
+    def event_renderer(self):
+        render = self.render_pretty_event if self.pretty_print else self.render_event
+        if self.verbatim:
+            return lambda event: self.render_verbatim(event, render)
+        return render
+
+    def separators(self, first=True):
+        """Returns the separators before the first and the following events:
+        the queued newline when pretty printing, a space between events
+        otherwise. first tells if the first event starts the event list."""
+        if self.pretty_print:
+            separator = "\r\n" + self.indent * self.indent_depth
+            return separator, separator
+        else:
+            return "" if first else " ", " "
+
+    def render_events(self, events, first=True):
+        """Renders the events as write_events would, separators included."""
+        render = self.event_renderer()
+        separator, next_separator = self.separators(first)
+
+        parts = []
+        for event in events:
+            parts.append(separator)
+            parts.append(render(event))
+            separator = next_separator
+        return "".join(parts)
+
+    def render_verbatim(self, event, render):
+        if type(event) is SourceEvent:
+            text = event.source_text()
+            if text is not None:
+                return text
+        return render(event)
+
+    def render_entries(self, entries):
+        return ["(%s (money %s))" % (entry.account_number, entry.cents) for entry in entries]
+
+    def render_head(self, event):
+        date = event.date
+        return '(event %s (date %s %s %s) "%s" (' % (event.number, date.year, date.month, date.day,
+            event.description.translate(ESCAPES))
+
+    def render_event(self, event):
+        return self.render_head(event) + " ".join(self.render_entries(event.entries)) + "))"
+
+    def render_pretty_event(self, event):
+        if not event.entries:
+            return self.render_head(event) + "))"
+
+        depth = self.indent_depth
+        entry_separator = "\r\n" + self.indent * (depth + 1)
+        return (self.render_head(event) + entry_separator
+            + entry_separator.join(self.render_entries(event.entries))
+            + "\r\n" + self.indent * depth + "))")
@@ -28,6 +28,7 @@ SCRIPTS = [
     'tappio-merge',
     'tappio-missing-accounts',
     'tappio-move-entries',
+    'tappio-periods',
     'tappio-print-accounts',
     'tappio-print-earnings',
     'tappio-renumber',
@@ -16,13 +16,35 @@
 #
 
 
-from io import StringIO
+import os
+import stat
+import threading
+import tracemalloc
+
+from datetime import date
+from io import BytesIO, StringIO
+from tempfile import NamedTemporaryFile, mkdtemp
+from shutil import rmtree
 
 from nose.tools import *
 
-from tappio.lexer import Lexer, LexerError
-from tappio.writer import Writer
-from tappio.parser import Parser, ParserError
+from tappio import loadf, load_stream, iterparse, iterparsef, dumps, dumpf, iterdump, iterdumpf, appendf
+from tappio import source_style
+from tappio import aggregate
+from tappio.append import find_tail, journal_path, JOURNAL_HEADER
+from tappio.balances import RunningBalances
+from tappio.cache import Cache
+from tappio.columns import EntryTable
+from tappio.indexes import ASSETS, LIABILITIES, EARNINGS
+from tappio.models import Document, Account, Event, Entry, SourceEvent
+from tappio.lexer import Lexer, FastLexer, BytesLexer, LexerError
+from tappio.writer import Writer, FastWriter
+from tappio.parser import Parser, FastParser, ParserError
+from tappio.periods import PeriodReport, split_periods, QUARTER
+from tappio.scripts.merge import merge, merge_headers, merge_events, Conflict
+from tappio.scripts.move_entries import read_mapping, remap_accounts, remapped_entries
+from tappio.scripts.extract import extract
+from tappio.scripts.renumber import renumber, external_sort
 
 from .helpers import skipped
 
@@ -162,6 +184,832 @@ def lexer_test():
     ])
 
 
+def lex_reference(input):
+    try:
+        return list(Lexer().lex_file(StringIO(input))), None
+    except LexerError as e:
+        return None, str(e)
+
+
+def lex_fast(input):
+    try:
+        return list(FastLexer().lex_string(input)), None
+    except LexerError as e:
+        return None, str(e)
+
+
+def fast_lexer_single(input):
+    assert_equal(lex_reference(input), lex_fast(input))
+
+
+def fast_lexer_test():
+    fast_lexer_single(SIMPLE_EXAMPLE)
+    fast_lexer_single(COMPLEX_EXAMPLE)
+
+    fast_lexer_single("")
+    fast_lexer_single("-")
+    fast_lexer_single("-abc")
+    fast_lexer_single("abc-1 2-3")
+    fast_lexer_single("foo123bar")
+    fast_lexer_single("(a)(b)")
+    fast_lexer_single('"foo"bar"baz"')
+    fast_lexer_single('"multi\nline\\" "spans\nlines"')
+    fast_lexer_single(r'"foo\"bar" "\\" "\n"')
+
+    # errors
+    fast_lexer_single('"foobar')
+    fast_lexer_single('"foobar\\')
+    fast_lexer_single('(foo #)')
+    fast_lexer_single('(foo \xe4)')
+
+
+def lex_bytes(input):
+    try:
+        return list(BytesLexer().lex_string(input.encode("ISO-8859-15"))), None
+    except LexerError as e:
+        return None, str(e)
+
+
+def bytes_lexer_test():
+    for input in [
+        SIMPLE_EXAMPLE,
+        COMPLEX_EXAMPLE,
+        "",
+        "-abc 102-102",
+        r'"foo\"bar" "\\"',
+        '"multi\r\nline"',
+        '"foobar',
+        '(foo \xe4)',
+    ]:
+        assert_equal(lex_fast(input.replace("\r\n", "\n")), lex_bytes(input))
+
+
+def lex_chunked(lexer, input, chunk_size):
+    tokens = []
+    try:
+        for i in range(0, len(input), chunk_size):
+            tokens.extend(lexer.feed_chunk(input[i:i + chunk_size]))
+        tokens.extend(lexer.close())
+    except LexerError as e:
+        return None, str(e)
+    return tokens, None
+
+
+def chunked_lexer_test():
+    for input in [
+        SIMPLE_EXAMPLE,
+        COMPLEX_EXAMPLE,
+        "-abc 102-102 foo123bar",
+        r'"foo\"bar" "\\"',
+        '"foobar',
+        '(foo \xe4)',
+    ]:
+        expected = lex_fast(input)
+        encoded = input.encode("ISO-8859-15")
+        for chunk_size in [1, 2, 3, 7, 64]:
+            assert_equal(expected, lex_chunked(FastLexer(), input, chunk_size))
+            assert_equal(expected, lex_chunked(FastLexer(), encoded, chunk_size))
+            assert_equal(expected, lex_chunked(BytesLexer(), encoded, chunk_size))
+
+    # CRLF split between chunks
+    assert_equal(lex_chunked(FastLexer(), b'"a\r\nb"', 3), ([("string", "a\nb")], None))
+
+    # bounded buffer
+    assert_equal(lex_chunked(FastLexer(max_pending=4), '"foobar" 1', 2),
+        (None, "token longer than 4 characters"))
+
+
+def document_tokens(document):
+    sio = StringIO()
+    Writer(stream=sio).write_document(document)
+    return list(Lexer().lex_string(sio.getvalue()))
+
+
+def loadf_test():
+    for input in [SIMPLE_EXAMPLE, COMPLEX_EXAMPLE, ""]:
+        with NamedTemporaryFile(suffix=".tlk", delete=False) as f:
+            f.write(input.encode("ISO-8859-15"))
+
+        try:
+            if input:
+                expected = Parser(Lexer().lex_string(input)).parse_document()
+                assert_equal(document_tokens(expected), document_tokens(loadf(f.name)))
+            else:
+                assert_raises(ParserError, loadf, f.name)
+        finally:
+            os.unlink(f.name)
+
+
+def load_stream_test():
+    expected = document_tokens(Parser(Lexer().lex_string(COMPLEX_EXAMPLE)).parse_document())
+    encoded = COMPLEX_EXAMPLE.encode("ISO-8859-15")
+
+    assert_equal(expected, document_tokens(load_stream(BytesIO(encoded), chunk_size=5)))
+    assert_equal(expected, document_tokens(load_stream(StringIO(COMPLEX_EXAMPLE), chunk_size=5)))
+
+
+def iterparse_test():
+    expected = Parser(Lexer().lex_string(COMPLEX_EXAMPLE)).parse_document()
+
+    items = iterparse(StringIO(COMPLEX_EXAMPLE))
+    header = next(items)
+    assert_true(isinstance(header, Document))
+    assert_equal(header.events, [])
+
+    events = list(items)
+    assert_true(all(isinstance(event, Event) for event in events))
+
+    header.events = events
+    assert_equal(document_tokens(expected), document_tokens(header))
+
+
+def distinct_events_example(count):
+    events = " ".join('(event {0} (date 2003 1 1) "event {0}" ((101 (money {0}))))'.format(i) for i in range(count))
+    return COMPLEX_EXAMPLE.replace('((event 1', '(' + events + ' (event 1')
+
+
+def peak_memory(function, *args):
+    tracemalloc.start()
+    try:
+        function(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def streaming_memory_test():
+    def stream(input):
+        for item in iterparse(input):
+            pass
+
+    def streamf(filename, cache=False):
+        for item in iterparsef(filename, cache=cache):
+            pass
+
+    small = distinct_events_example(1000)
+    large = distinct_events_example(10000)
+    assert_true(peak_memory(stream, StringIO(large)) < 2 * peak_memory(stream, StringIO(small)))
+
+    filenames = [write_temp(small), write_temp(large)]
+    directory = mkdtemp()
+    try:
+        assert_true(peak_memory(streamf, filenames[1]) < 2 * peak_memory(streamf, filenames[0]))
+
+        # while filling the cache and when served from it
+        cache = Cache(directory)
+        for i in range(2):
+            peaks = [peak_memory(streamf, filename, cache) for filename in filenames]
+            assert_true(peaks[1] < 2 * peaks[0])
+        assert_true(all(os.path.exists(cache.path_for(filename)) for filename in filenames))
+    finally:
+        for filename in filenames:
+            os.unlink(filename)
+        rmtree(directory)
+
+
+def parse_reference(input):
+    try:
+        return document_tokens(Parser(Lexer().lex_string(input)).parse_document()), None
+    except (LexerError, ParserError, ValueError) as e:
+        return None, (type(e), str(e))
+
+
+def parse_fast(input):
+    try:
+        return document_tokens(FastParser(input).parse_document()), None
+    except (LexerError, ParserError, ValueError) as e:
+        return None, (type(e), str(e))
+
+
+def fast_parser_test():
+    events = (
+        '(event 2 (date 2003 1 2) "no entries")'
+        '(event 3(date 2003 1 3)"tight"((101(money 5))(201(money -5))))'
+        '(event 4 (date 2003 1 4) "empty" ())'
+        '(event 5 (date 2003 1 5) "esc\\"aped\\\\" ((101 (money 1))))'
+    )
+    good = COMPLEX_EXAMPLE.replace('((event 1', '(' + events + '(event 1')
+
+    inputs = [
+        SIMPLE_EXAMPLE,
+        COMPLEX_EXAMPLE,
+        good,
+        good.replace("(event 4", "(event -"),
+        good.replace("(event 4", "(evnt 4"),
+        good.replace("(money 5)", "(money5)"),
+        good.replace("(money 5)", "(money-5)"),
+        good.replace("(money 5)", "(money 5 6)"),
+        good.replace("(date 2003 1 3)", "(date 2003 13 3)"),
+        good.replace("(date 2003 1 3)", "(date 2003 -1 3)"),
+        good.replace('"tight"', '"tight'),
+        good.replace('"tight"', '"tight"#'),
+        good.rstrip()[:-1],
+        good.rstrip()[:-30],
+    ]
+
+    for input in inputs:
+        assert_equal(parse_reference(input), parse_fast(input))
+        assert_equal(parse_reference(input), parse_fast(input.encode("ISO-8859-15")))
+
+
+def write_temp(input):
+    with NamedTemporaryFile(suffix=".tlk", delete=False) as f:
+        f.write(input.encode("ISO-8859-15"))
+    return f.name
+
+
+def iterparsef_document(filename):
+    items = iterparsef(filename, keep_source=True)
+    header = next(items)
+    header.events = list(items)
+    return header
+
+
+def pipe_test():
+    expected = document_tokens(Parser(Lexer().lex_string(COMPLEX_EXAMPLE)).parse_document())
+
+    def write_fifo(fifo):
+        with open(fifo, "wb") as f:
+            f.write(COMPLEX_EXAMPLE.encode("ISO-8859-15"))
+
+    directory = mkdtemp()
+    try:
+        fifo = os.path.join(directory, "fifo")
+        os.mkfifo(fifo)
+
+        for load in [loadf, lambda filename: loadf(filename, lazy=True), iterparsef_document]:
+            writer = threading.Thread(target=write_fifo, args=(fifo,), daemon=True)
+            writer.start()
+            assert_equal(expected, document_tokens(load(fifo)))
+            writer.join(10)
+    finally:
+        rmtree(directory)
+
+
+def lazy_loadf_test():
+    events = (
+        '(event 2 (date 2003 1 2) "no entries")'
+        '(event 3 (date 2003 1 3) "deep (((((" ((101 (money 5)) (201 (money -5))))'
+        '(event 4 (date 2003 1 4) "odd" ((101 (money 1 )) (201 (money -1)) ) )'
+    )
+    input = COMPLEX_EXAMPLE.replace('((event 1', '(' + events + '(event 1')
+    expected = Parser(Lexer().lex_string(input)).parse_document()
+
+    filename = write_temp(input)
+    try:
+        document = loadf(filename, lazy=True)
+        assert_equal(len(expected.events), len(document.events))
+        assert_false(document.events.is_decoded(1))
+        assert_equal("deep (((((", document.events[1].description)
+        assert_true(document.events[1] is document.events[1])
+        assert_equal(document_tokens(expected), document_tokens(document))
+
+        document.events.insert(0, Event(0, expected.begin, "first"))
+        document.events.sort(key=lambda event: -event.number)
+        assert_equal([4, 3, 2, 1, 0], [event.number for event in document.events])
+    finally:
+        os.unlink(filename)
+
+    # Malformed events are only noticed when accessed.
+    filename = write_temp(input.replace("(event 4", "(event x"))
+    try:
+        document = loadf(filename, lazy=True)
+        assert_equal("no entries", document.events[0].description)
+        assert_raises(ParserError, document.events.__getitem__, 2)
+    finally:
+        os.unlink(filename)
+
+
+def parallel_loadf_test():
+    events = "".join(
+        '(event {0} (date 2003 1 {0}) "event {0}" ((101 (money {0})) (201 (money -{0}))))'.format(i)
+        for i in range(2, 10)
+    )
+    input = COMPLEX_EXAMPLE.replace('((event 1', '(' + events + '(event 1')
+    expected = document_tokens(Parser(Lexer().lex_string(input)).parse_document())
+
+    filename = write_temp(input)
+    try:
+        for chunk_size in [1, 4, 100]:
+            assert_equal(expected, document_tokens(loadf(filename, workers=2, chunk_size=chunk_size)))
+    finally:
+        os.unlink(filename)
+
+
+def appendf_test():
+    document = Parser(Lexer().lex_string(COMPLEX_EXAMPLE)).parse_document()
+    new_events = [Event(2, document.end, 'new "one"', [Entry(101, 5), Entry(201, -5)]), Event(3, document.end, "")]
+
+    for kwargs in [{}, {"pretty_print": True}, {"pretty_print": True, "indent": "\t"}]:
+        for events in [document.events, []]:
+            original = Document(document.identity, document.version, document.name, document.begin,
+                document.end, document.accounts, list(events))
+            filename = write_temp(dumps(original, **kwargs))
+            try:
+                appendf(filename, new_events[:1])
+                appendf(filename, new_events[1:])
+                original.events.extend(new_events)
+                with open(filename, encoding="ISO-8859-15", newline="") as f:
+                    assert_equal(dumps(original, **kwargs), f.read())
+            finally:
+                os.unlink(filename)
+
+    # An append interrupted after the journal was written is undone.
+    filename = write_temp(dumps(document))
+    try:
+        with open(filename, "rb") as f:
+            offset, tail, empty = find_tail(f)
+        with open(journal_path(filename), "wb") as journal:
+            journal.write(JOURNAL_HEADER.pack(offset, len(tail)) + tail)
+        with open(filename, "r+b") as f:
+            f.seek(offset)
+            f.write(b" (event 2 (dat")
+
+        appendf(filename, new_events[1:])
+        assert_false(os.path.exists(journal_path(filename)))
+        assert_equal([1, 3], [event.number for event in loadf(filename, cache=False).events])
+    finally:
+        os.unlink(filename)
+
+    # Reading recovers the file, too, even if it was left without its tail.
+    filename = write_temp(dumps(document))
+    try:
+        for load in [lambda filename: loadf(filename, cache=False), iterparsef_document]:
+            with open(filename, "r+b") as f:
+                offset, tail, empty = find_tail(f)
+                with open(journal_path(filename), "wb") as journal:
+                    journal.write(JOURNAL_HEADER.pack(offset, len(tail)) + tail)
+                f.truncate(offset)
+
+            assert_equal([1], [event.number for event in load(filename).events])
+            assert_false(os.path.exists(journal_path(filename)))
+    finally:
+        os.unlink(filename)
+
+    filename = write_temp("(foo")
+    try:
+        assert_raises(ParserError, appendf, filename, new_events)
+    finally:
+        os.unlink(filename)
+
+
+def verbatim_test():
+    events = (
+        '(event 2 (date 2003 1 2) "kept"  ((101   (money 5)) (201 (money -5))))'
+        '(event 3 (date 2003 1 3) "moved" ((101 (money 7)) (201 (money -7))))'
+        '(event 4 (date 2003 1 4) "edited" ((101 (money 1)) (201 (money -1))))'
+        '(event 5 (date 2003 1 5) "added to"  ((101 (money 2))))'
+    )
+    input = COMPLEX_EXAMPLE.replace('((event 1', '(' + events + '(event 1')
+
+    filename = write_temp(input)
+    try:
+        for document in [loadf(filename, keep_source=True), loadf(filename, lazy=True, keep_source=True)]:
+            assert_equal('(event 2 (date 2003 1 2) "kept"  ((101   (money 5)) (201 (money -5))))',
+                document.events[0].source_text())
+
+            document.events[1].entries[0].account_number = 102
+            document.events[2].description = "changed"
+            document.events[3].entries.append(Entry(201, -2))
+            assert_equal(None, document.events[1].source_text())
+            assert_false(isinstance(document.events[2], SourceEvent))
+
+            output = dumps(document, verbatim=True)
+            assert_true('(event 2 (date 2003 1 2) "kept"  ((101   (money 5)) (201 (money -5))))' in output)
+            assert_true('(event 3 (date 2003 1 3) "moved" ((102 (money 7)) (201 (money -7))))' in output)
+            assert_true('(event 4 (date 2003 1 4) "changed" ((101 (money 1)) (201 (money -1))))' in output)
+            assert_true('(event 5 (date 2003 1 5) "added to" ((101 (money 2)) (201 (money -2))))' in output)
+            assert_equal(document_tokens(document), list(Lexer().lex_string(output)))
+
+        # Streaming
+        items = iterparsef(filename, keep_source=True)
+        header = next(items)
+        sio = StringIO()
+        iterdump(sio, header, items, verbatim=True)
+        assert_true('"kept"  ((101   (money 5))' in sio.getvalue())
+
+        assert_equal({"verbatim": True, "pretty_print": False, "indent": "  "}, source_style(filename))
+        assert_equal({"verbatim": True}, source_style(None))
+    finally:
+        os.unlink(filename)
+
+
+def event_tuples(events):
+    return [(event.number, event.date, event.description,
+        [(entry.account_number, entry.cents) for entry in event.entries]) for event in events]
+
+
+def extract_test():
+    events = (
+        '(event 2 (date 2003 2 1) "kept"  ((101   (money 5)) (300 (money -5))))'
+        '(event 3 (date 2003 3 1) "after" ((101 (money 7)) (201 (money -7))))'
+    )
+    input = COMPLEX_EXAMPLE.replace('((event 1', '(' + events + '(event 1')
+    expected = [
+        (0, date(2003, 2, 1), "Tilinavaukset", [(101, 123456), (201, -123456)]),
+        (2, date(2003, 2, 1), "kept", [(101, 5), (300, -5)]),
+    ]
+
+    filename = write_temp(input)
+    try:
+        # not sorted after all
+        assert_raises(ValueError, extract, "2003-01-01", "2003-12-31", filename, filename, True)
+
+        extract("2003-02-01", "2003-02-28", filename, filename)
+        with open(filename, encoding="ISO-8859-15") as f:
+            output = f.read()
+        assert_true('"kept"  ((101   (money 5))' in output)
+
+        document = loadf(filename)
+        assert_equal((date(2003, 2, 1), date(2003, 2, 28)), (document.begin, document.end))
+        assert_equal(expected, event_tuples(document.events))
+    finally:
+        os.unlink(filename)
+
+    filename = write_temp(COMPLEX_EXAMPLE.replace('(money -123456))))', '(money -123456))))' + events))
+    try:
+        extract("2003-02-01", "2003-02-28", filename, filename, True)
+        assert_equal(expected, event_tuples(loadf(filename).events))
+    finally:
+        os.unlink(filename)
+
+
+def remap_test():
+    directory = mkdtemp()
+    try:
+        filename = os.path.join(directory, "mapping.csv")
+        with open(filename, "w") as f:
+            f.write("from,to\n101,102\n300,400\n\n201,101\n")
+        mapping = read_mapping(filename)
+        assert_equal({101: 102, 300: 400, 201: 101}, mapping)
+
+        with open(filename, "a") as f:
+            f.write("300,201\n")
+        assert_raises(ValueError, read_mapping, filename)
+    finally:
+        rmtree(directory)
+
+    # 102 is under 101, so it takes the place of 101
+    document = Parser(Lexer().lex_string(COMPLEX_EXAMPLE.replace('(account 101 "Pankkitili" ())',
+        '(account 101 "Pankkitili" ((account 103 "Tili" ()) (account 102 "Kassa" ())))'))).parse_document()
+    remap_accounts(document, mapping)
+    assert_equal([(None, 0), (102, 1), (103, 2), (None, 0), (101, 1), (None, 0), (400, 1)],
+        [(account.number, document.account_index().depths[account]) for account in document.account_index()])
+    assert_raises(ValueError, remap_accounts, document, {300: 400})
+    assert_raises(ValueError, remap_accounts, document, {400: 500})
+
+    events = [
+        Event(1, date(2003, 1, 1), "", [Entry(101, 10), Entry(201, -10)]),
+        Event(2, date(2003, 1, 2), "", [Entry(300, 5), Entry(400, -3), Entry(201, -2)]),
+    ]
+    assert_equal([
+        (1, date(2003, 1, 1), "", [(102, 10), (101, -10)]),
+        (2, date(2003, 1, 2), "", [(400, 2), (101, -2)]),
+    ], event_tuples(remapped_entries(events, mapping, merge=True)))
+
+
+def merge_test():
+    earlier = Parser(Lexer().lex_string(COMPLEX_EXAMPLE)).parse_document()
+    later = Parser(Lexer().lex_string(COMPLEX_EXAMPLE.replace('"Tulot"', '"Myynti"')
+        .replace('(account 101 "Pankkitili" ())', '(account 101 "Pankkitili" ()) (account 102 "Kassa" ())')
+        .replace('(date 2003 12 31)', '(date 2004 12 31)')
+        .replace('(date 2003 1 1) "Tilinavaus"', '(date 2003 1 1) "Toinen"'))).parse_document()
+    earlier.events.append(Event(2, date(2003, 2, 1), "Helmikuu"))
+
+    merged, conflicts = merge_headers([earlier, later])
+    assert_equal([Conflict(300, "name", "Tulot", "Myynti")], conflicts)
+    assert_equal((date(2003, 1, 1), date(2004, 12, 31)), (merged.begin, merged.end))
+    assert_equal([None, 101, 102, None, 201, None, 300, 400], [account.number for account in merged.account_index()])
+    assert_equal("Myynti", merged.account_index()[300].name)
+
+    # merge() leaves the documents as they were
+    document = merge(earlier, later)
+    assert_equal([(1, "Tilinavaus"), (2, "Toinen"), (3, "Helmikuu")],
+        [(event.number, event.description) for event in document.events])
+    assert_equal([1, 2, 1], [event.number for event in earlier.events + later.events])
+    document.events[0].entries[0].cents = 0
+    assert_equal(123456, earlier.events[0].entries[0].cents)
+
+    events = list(merge_events([iter(earlier.events), iter(later.events)]))
+    assert_equal([(1, "Tilinavaus"), (2, "Toinen"), (3, "Helmikuu")],
+        [(event.number, event.description) for event in events])
+
+
+def renumber_test():
+    events = [Event(i, date(2003, 1 + i * 7 % 12, 1), str(i), [Entry(101, i)]) for i in range(1, 30)]
+    expected = [event.description for event in sorted(events, key=lambda x: (x.date, x.number))]
+
+    # a budget of a couple of events forces several runs
+    assert_equal(expected, [event.description for event in external_sort(iter(events), 1000)])
+    assert_equal(expected, [event.description for event in external_sort(iter(events))])
+    in_order = sorted(events, key=lambda x: (x.date, x.number))
+    assert_equal(expected, [event.description for event in external_sort(iter(in_order), 1000)])
+
+    directory = mkdtemp()
+    try:
+        input_filename = os.path.join(directory, "input.tlk")
+        output_filename = os.path.join(directory, "output.tlk")
+        document = Parser(Lexer().lex_string(COMPLEX_EXAMPLE)).parse_document()
+
+        # unsorted
+        document.events = events
+        iterdumpf(input_filename, document, iter(events))
+        renumber(input_filename, output_filename, 1000)
+        output = loadf(output_filename)
+        assert_equal(expected, [event.description for event in output.events])
+        assert_equal(list(range(1, 30)), [event.number for event in output.events])
+
+        # already sorted, renumbered in a single pass
+        renumber(output_filename, input_filename)
+        assert_equal(document_tokens(output), document_tokens(loadf(input_filename)))
+    finally:
+        rmtree(directory)
+
+
+def cache_test():
+    directory = mkdtemp()
+    try:
+        filename = os.path.join(directory, "ledger.tlk")
+        with open(filename, "wb") as f:
+            f.write(COMPLEX_EXAMPLE.encode("ISO-8859-15"))
+
+        # next to the source
+        cache = Cache()
+        assert_equal(None, cache.load(filename))
+        expected = document_tokens(loadf(filename, cache=cache))
+        assert_true(os.path.exists(os.path.join(directory, "ledger.tlkc")))
+        assert_equal(expected, document_tokens(cache.load(filename)))
+        assert_equal(expected, document_tokens(loadf(filename, cache=cache)))
+
+        # touched but not modified
+        st = os.stat(filename)
+        os.utime(filename, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+        assert_equal(expected, document_tokens(cache.load(filename)))
+
+        # modified
+        with open(filename, "wb") as f:
+            f.write(SIMPLE_EXAMPLE.encode("ISO-8859-15"))
+        assert_equal(None, cache.load(filename))
+        assert_equal(document_tokens(Parser(Lexer().lex_string(SIMPLE_EXAMPLE)).parse_document()),
+            document_tokens(loadf(filename, cache=cache)))
+
+        # size-bounded cache directory
+        cache_dir = os.path.join(directory, "cache")
+        cache = Cache(cache_dir, max_size=1)
+        loadf(filename, cache=cache)
+        assert_equal(1, len(os.listdir(cache_dir)))
+        other = os.path.join(directory, "other.tlk")
+        with open(other, "wb") as f:
+            f.write(COMPLEX_EXAMPLE.encode("ISO-8859-15"))
+        loadf(other, cache=cache)
+        assert_equal([os.path.basename(cache.path_for(other))], os.listdir(cache_dir))
+
+        assert_equal(None, Cache.from_environment({}))
+        assert_equal(cache_dir, Cache.from_environment({"TAPPIO_CACHE_DIR": cache_dir}).directory)
+    finally:
+        rmtree(directory)
+
+
+class CountingCache(Cache):
+    hits = 0
+
+    def iterload(self, filename):
+        items = super(CountingCache, self).iterload(filename)
+        if items is not None:
+            self.hits += 1
+        return items
+
+
+def iterparsef_cache_test():
+    directory = mkdtemp()
+    try:
+        filename = os.path.join(directory, "ledger.tlk")
+        with open(filename, "wb") as f:
+            f.write(COMPLEX_EXAMPLE.encode("ISO-8859-15"))
+        expected = document_tokens(loadf(filename, cache=False))
+        cache = CountingCache()
+
+        # not stored before a full pass
+        items = iterparsef(filename, cache=cache)
+        next(items)
+        items.close()
+        assert_false(os.path.exists(cache.path_for(filename)))
+
+        # stored as read, even if modified meanwhile
+        items = iterparsef(filename, cache=cache)
+        header = next(items)
+        header.name = "changed"
+        for event in items:
+            event.number = 10
+        assert_equal(0, cache.hits)
+
+        items = iterparsef(filename, cache=cache)
+        header = next(items)
+        header.events = list(items)
+        assert_equal(1, cache.hits)
+        assert_equal(expected, document_tokens(header))
+
+        # no source text in the cache
+        header = next(iterparsef(filename, keep_source=True, cache=cache))
+        assert_equal(1, cache.hits)
+    finally:
+        rmtree(directory)
+
+
+def entry_table_test():
+    document = Parser(Lexer().lex_string(COMPLEX_EXAMPLE)).parse_document()
+
+    table = document.entry_table()
+    assert_true(table is document.entry_table())
+    assert_equal([(0, 731216, 101, 123456), (0, 731216, 201, -123456)], list(table.rows()))
+    assert_equal({101: 123456, 201: -123456}, table.sum_by_account())
+    assert_equal({}, table.sum_by_account(before=document.begin))
+
+    document.events[0].entries[0].cents = 1
+    document.invalidate()
+    assert_equal(1, document.entry_table().cents[0])
+
+    document.events.append(Event(2, document.end, "", document.events[0].entries))
+    assert_equal(4, len(document.entry_table()))
+
+    document.events = []
+    assert_equal(0, len(document.entry_table()))
+
+
+def shared_values_test():
+    events = "".join(
+        '(event {0} (date 2003 1 1) "Tilinavaus" ((101 (money {0}))))'.format(i)
+        for i in range(2, 5)
+    )
+    input = COMPLEX_EXAMPLE.replace('((event 1', '(' + events + '(event 1')
+
+    for document in [Parser(Lexer().lex_string(input)).parse_document(), FastParser(input).parse_document()]:
+        assert_equal(1, len(set(id(event.date) for event in document.events)))
+        assert_equal(1, len(set(id(event.description) for event in document.events)))
+        assert_raises(AttributeError, setattr, document.events[0], "foo", 1)
+
+
+def account_index_test():
+    document = Parser(Lexer().lex_string(COMPLEX_EXAMPLE)).parse_document()
+    assets, liabilities, earnings = document.accounts
+
+    index = document.account_index()
+    assert_true(index is document.account_index())
+    assert_equal(7, len(index))
+    assert_equal([None, 101, None, 201, None, 300, 400], [account.number for account in index])
+    assert_equal("Tulot", index[300].name)
+    assert_true(101 in index)
+    assert_false(None in index)
+    assert_equal(None, index.get(999))
+
+    assert_true(index.parent(index[300]) is earnings)
+    assert_equal([earnings], index.ancestors(index[300]))
+    assert_equal(1, index.depth(index[300]))
+    assert_equal(0, index.depth(earnings))
+    assert_equal(LIABILITIES, index.tree(index[201]))
+    assert_equal(EARNINGS, index.tree_of(400))
+    assert_true(index.is_balance_sheet(101))
+    assert_false(index.is_balance_sheet(300))
+    assert_equal({101, 201}, index.numbers(ASSETS, LIABILITIES))
+    assert_equal({101, 201, 300, 400}, index.numbers())
+
+    # rebuilt when the tree changes
+    assets.subaccounts[0].subaccounts.append(Account(102, "Kassa"))
+    assert_false(index is document.account_index())
+    assert_equal([assets, assets.subaccounts[0]], document.account_index().ancestors(document.account_index()[102])[::-1])
+
+
+def events_between_test():
+    events = [Event(number, date(2010, month, 1)) for number, month in
+        [(1, 1), (2, 3), (3, 3), (4, 6), (5, 12)]]
+    document = Document(events=list(events))
+
+    assert_true(document.date_index().is_sorted)
+    assert_equal([2, 3, 4], [e.number for e in document.events_between(date(2010, 2, 1), date(2010, 6, 1))])
+    assert_equal([1, 2, 3], [e.number for e in document.events_between(to_date=date(2010, 3, 1))])
+    assert_equal([5], [e.number for e in document.events_between(from_date=date(2010, 7, 1))])
+    assert_equal(0, len(document.events_between(date(2010, 7, 1), date(2010, 2, 1))))
+
+    document.events = [events[3], events[0], events[2], events[4], events[1]]
+    index = document.date_index()
+    assert_false(index.is_sorted)
+    view = document.events_between(date(2010, 3, 1), date(2010, 12, 31))
+    assert_equal([2, 3, 4, 5], [e.number for e in view])
+    assert_equal([4, 3, 5, 2], [e.number for e in view.in_document_order()])
+    assert_equal([3, 4], [e.number for e in view[1:3]])
+
+    document.events.append(Event(6, date(2010, 3, 1)))
+    assert_false(index is document.date_index())
+    assert_equal([2, 3, 6], [e.number for e in document.events_between(date(2010, 3, 1), date(2010, 3, 1))])
+
+
+def running_balances_test():
+    events = [Event(number, date(2010, month, 1), "", [Entry(101, cents), Entry(300, -cents)])
+        for number, month, cents in [(1, 1, 100), (2, 3, 20), (3, 3, 3), (4, 6, 4000)]]
+    document = Document(events=events)
+
+    balances = document.running_balances()
+    assert_true(balances is document.running_balances())
+    assert_equal(0, balances.balance_at(101, date(2009, 12, 31)))
+    assert_equal(100, balances.balance_at(101, date(2010, 1, 1)))
+    assert_equal(100, balances.balance_before(101, date(2010, 3, 1)))
+    assert_equal(123, balances.balance_at(101, date(2010, 3, 1)))
+    assert_equal(-4123, balances.balance_at(300, date(2011, 1, 1)))
+    assert_equal(0, balances.balance_at(999, date(2011, 1, 1)))
+    assert_equal({}, balances.balances_before(date(2010, 1, 1)))
+    assert_equal({101: 123}, balances.balances_at(date(2010, 3, 1), [101, 201]))
+
+    # Back-dated and same-day events are added in place.
+    balances.add_event(Event(5, date(2010, 2, 1), "", [Entry(101, 5), Entry(201, -5)]))
+    balances.add_event(Event(6, date(2010, 6, 1), "", [Entry(101, 1)]))
+    assert_equal(105, balances.balance_at(101, date(2010, 2, 28)))
+    assert_equal(4129, balances.balance_at(101, date(2010, 6, 1)))
+    assert_equal(-5, balances.balance_before(201, date(2010, 3, 1)))
+
+    expected = RunningBalances(document.events + [Event(7, date(2009, 1, 1), "", [Entry(101, 7)])])
+    assert_equal(107, expected.balance_at(101, date(2010, 1, 1)))
+
+
+def rollup_test():
+    document = Parser(Lexer().lex_string(COMPLEX_EXAMPLE)).parse_document()
+    assets, liabilities, earnings = document.accounts
+    earnings.subaccounts.append(Account(None, "Muut", [Account(500, "Korot"), Account(501, "Lahjat")]))
+    document.events.append(Event(2, document.end, "", [Entry(300, -500), Entry(500, 200), Entry(501, 100), Entry(101, 200)]))
+
+    rollup = document.rollup()
+    assert_true(rollup is document.rollup())
+    assert_equal(123656, rollup[assets])
+    assert_equal(-123456, rollup.total(201))
+    assert_equal(300, rollup[earnings.subaccounts[2]])
+    assert_equal(-200, rollup[earnings])
+    assert_equal([(None, 0, 123656), (101, 1, 123656), (None, 0, -123456), (201, 1, -123456)],
+        [(account.number, depth, cents) for account, depth, cents in rollup.balance_sheet()])
+    assert_equal([None, 300, 400, None, 500, 501],
+        [account.number for account, depth, cents in rollup.income_statement()])
+    assert_equal([(None, 0, 300), (500, 1, 200), (501, 1, 100)],
+        [(account.number, depth, cents) for account, depth, cents in rollup.subtree(earnings.subaccounts[2])])
+
+    document.events.pop()
+    assert_equal(0, document.rollup()[earnings])
+
+    earnings.subaccounts[2].subaccounts[1].number = 502
+    assert_equal(0, document.rollup().total(502))
+
+
+def aggregate_test():
+    events = [
+        Event(1, date(2010, 1, 31), "", [Entry(101, 2 ** 62), Entry(300, -2 ** 62)]),
+        Event(2, date(2010, 2, 1), "", [Entry(101, 1), Entry(300, -1)]),
+        Event(3, date(2011, 2, 28), "", [Entry(101, 5), Entry(-1, 7), Entry(101, -10)]),
+    ]
+    table = EntryTable(events)
+
+    by_account = {101: 2 ** 62 - 4, 300: -2 ** 62 - 1, -1: 7}
+    by_month = {(101, 2010, 1): 2 ** 62, (300, 2010, 1): -2 ** 62, (101, 2010, 2): 1,
+        (300, 2010, 2): -1, (101, 2011, 2): -5, (-1, 2011, 2): 7}
+
+    backends = [(aggregate.python_sum_by_account, aggregate.python_sum_by_account_and_month)]
+    if aggregate.numpy is not None:
+        backends.append((aggregate.numpy_sum_by_account, aggregate.numpy_sum_by_account_and_month))
+
+    dense_limit = aggregate.DENSE_LIMIT
+    try:
+        # A zero limit makes NumPy sort the rows instead of using dense sums.
+        for aggregate.DENSE_LIMIT in [dense_limit, 0]:
+            for sum_by_account, sum_by_account_and_month in backends:
+                assert_equal(by_account, sum_by_account(table))
+                assert_equal({101: 2 ** 62, 300: -2 ** 62}, sum_by_account(table, before=date(2010, 2, 1)))
+                assert_equal({}, sum_by_account(table, before=date(2010, 1, 31)))
+                assert_equal(by_month, sum_by_account_and_month(table))
+                assert_equal({}, sum_by_account(EntryTable()))
+                assert_equal({}, sum_by_account_and_month(EntryTable()))
+                assert_true(all(type(cents) is int for cents in sum_by_account(table).values()))
+    finally:
+        aggregate.DENSE_LIMIT = dense_limit
+
+
+def period_report_test():
+    assert_equal([("2010Q1", date(2010, 2, 15), date(2010, 3, 31)), ("2010Q2", date(2010, 4, 1), date(2010, 6, 30)),
+        ("2010Q3", date(2010, 7, 1), date(2010, 7, 10))], split_periods(date(2010, 2, 15), date(2010, 7, 10), QUARTER))
+    assert_equal(12, len(split_periods(date(2010, 1, 1), date(2010, 12, 31))))
+    assert_equal(("2011-01", date(2011, 1, 1), date(2011, 1, 31)), split_periods(date(2010, 12, 1), date(2011, 1, 31))[1])
+
+    report = PeriodReport(date(2010, 1, 1), date(2010, 3, 31)).add_events([
+        Event(1, date(2009, 12, 31), "", [Entry(101, 100), Entry(201, -100)]),
+        Event(2, date(2010, 1, 1), "", [Entry(101, 10), Entry(300, -10)]),
+        Event(3, date(2010, 3, 31), "", [Entry(101, 5), Entry(300, -5)]),
+        Event(4, date(2010, 4, 1), "", [Entry(101, 1000), Entry(300, -1000)]),
+    ])
+    assert_equal({101, 201, 300}, report.account_numbers())
+    assert_equal([10, 0, 5], report.movements_of(101))
+    assert_equal([110, 110, 115], report.balances_of(101))
+    assert_equal([0, 0, 0], report.movements_of(201))
+    assert_equal([-100, -100, -100], report.balances_of(201))
+    assert_equal([-10, -10, -15], report.balances_of(300))
+    assert_equal(100, report.opening_of(101))
+    assert_equal(0, report.opening_of(300))
+
+
 def parser_single(input):
     lex = Lexer()
 
@@ -192,3 +1040,107 @@ def parser_test():
 def writer_test():
     writer_single(SIMPLE_EXAMPLE)
     writer_single(COMPLEX_EXAMPLE)
+
+
+def fast_writer_test():
+    document = Parser(Lexer().lex_string(COMPLEX_EXAMPLE)).parse_document()
+    document.accounts[0].subaccounts[0].vat_type = "ALV"
+    document.accounts[0].subaccounts[0].vat_percent = 24
+    document.events.append(Event(2, document.end, 'a "b" \\ c\nd ( )'))
+    document.events.append(Event(3, document.end, "", document.events[0].entries * 2))
+
+    for kwargs in [{}, {"pretty_print": True}, {"pretty_print": True, "indent": "\t"}]:
+        for buffer_size in [1, 1000]:
+            expected = StringIO()
+            Writer(expected, **kwargs).write_document(document)
+            actual = StringIO()
+            FastWriter(actual, buffer_size=buffer_size, **kwargs).write_document(document)
+            assert_equal(expected.getvalue(), actual.getvalue())
+
+    expected = StringIO()
+    Writer(expected).write_document(document)
+    assert_equal(expected.getvalue(), dumps(document))
+
+
+def parallel_dump_test():
+    document = Parser(Lexer().lex_string(COMPLEX_EXAMPLE)).parse_document()
+    document.events.extend(Event(i, document.end, "event {0}".format(i),
+        [Entry(101, i), Entry(201, -i)] if i % 3 else []) for i in range(2, 12))
+
+    for kwargs in [{}, {"pretty_print": True}, {"pretty_print": True, "indent": "\t"}]:
+        for chunk_size in [1, 4, 100]:
+            assert_equal(dumps(document, **kwargs), dumps(document, workers=2, chunk_size=chunk_size, **kwargs))
+
+    assert_equal(dumps(Document()), dumps(Document(), workers=2))
+    assert_equal(dumps(document), dumps(document, chunk_size=4))
+
+
+def dumpf_links_test():
+    document = Parser(Lexer().lex_string(COMPLEX_EXAMPLE)).parse_document()
+    expected = dumps(document)
+
+    directory = mkdtemp()
+    try:
+        target = os.path.join(directory, "ledger.tlk")
+        with open(target, "w") as f:
+            f.write("old")
+
+        # symbolic links are followed
+        link = os.path.join(directory, "link.tlk")
+        os.symlink("ledger.tlk", link)
+        dumpf(link, document)
+        assert_true(os.path.islink(link))
+        with open(target, encoding="ISO-8859-15", newline="") as f:
+            assert_equal(expected, f.read())
+
+        # hard links are kept
+        hard_link = os.path.join(directory, "hard.tlk")
+        os.link(target, hard_link)
+        dumpf(hard_link, document, pretty_print=True)
+        assert_true(os.path.samefile(target, hard_link))
+        assert_equal([2, 2], [os.stat(filename).st_nlink for filename in (target, hard_link)])
+
+        # other files are written to
+        fifo = os.path.join(directory, "fifo")
+        os.mkfifo(fifo)
+        output = []
+        reader = threading.Thread(target=lambda: output.append(open(fifo, "rb").read()), daemon=True)
+        reader.start()
+        dumpf(fifo, document)
+        reader.join(10)
+        assert_true(stat.S_ISFIFO(os.stat(fifo).st_mode))
+        assert_equal([expected.encode("ISO-8859-15")], output)
+    finally:
+        rmtree(directory)
+
+
+def iterdump_test():
+    document = Parser(Lexer().lex_string(COMPLEX_EXAMPLE)).parse_document()
+    document.events.append(Event(2, document.end, "second"))
+    expected = dumps(document, pretty_print=True)
+
+    sio = StringIO()
+    iterdump(sio, Document(document.identity, document.version, document.name, document.begin,
+        document.end, document.accounts), iter(document.events), pretty_print=True)
+    assert_equal(expected, sio.getvalue())
+
+    # Streaming a file onto itself.
+    filename = write_temp(COMPLEX_EXAMPLE)
+    try:
+        os.chmod(filename, 0o640)
+        items = iterparsef(filename)
+        header = next(items)
+        iterdumpf(filename, header, (Event(event.number + 1, event.date, event.description, event.entries)
+            for event in items))
+        assert_equal([2], [event.number for event in loadf(filename, cache=False).events])
+        assert_equal(0o640, os.stat(filename).st_mode & 0o777)
+
+        def failing():
+            yield Event(3, header.begin)
+            raise ValueError()
+        assert_raises(ValueError, iterdumpf, filename, header, failing())
+        assert_equal([2], [event.number for event in loadf(filename, cache=False).events])
+        assert_equal([os.path.basename(filename)],
+            [name for name in os.listdir(os.path.dirname(filename)) if os.path.basename(filename) in name])
+    finally:
+        os.unlink(filename)
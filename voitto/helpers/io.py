@@ -21,8 +21,14 @@ I/O related helpers.
 """
 
 
+import mmap
+import os
+import shutil
+import stat
+
 from contextlib import contextmanager
 from sys import stdout
+from tempfile import mkstemp
 
 
 @contextmanager
@@ -32,3 +38,88 @@ def output_stream(output_filename=None, mode='wb'):
     else:
         with open(output_filename, mode) as f:
             yield f
+
+
+@contextmanager
+def replaced_file(output_filename, mode='w', **kwargs):
+    """Opens a temporary file next to output_filename and renames it over
+    output_filename when leaving the context without an exception.
+
+    Readers of the old file, including memory mappings of it, are not
+    affected, so the output can be streamed while reading the same file.
+
+    Symbolic links are followed, and the mode and, where permitted, the
+    owner of an existing file are kept. A file with several hard links is
+    rewritten in place from the temporary file instead of being replaced.
+    Anything but a regular file, such as /dev/stdout, is simply written to."""
+    output_filename = os.path.realpath(output_filename)
+    try:
+        st = os.stat(output_filename)
+    except FileNotFoundError:
+        st = None
+
+    if st is not None and not stat.S_ISREG(st.st_mode):
+        with open(output_filename, mode, **kwargs) as f:
+            yield f
+        return
+
+    directory, basename = os.path.split(output_filename)
+    fd, temp_filename = mkstemp(prefix="." + basename, suffix=".tmp", dir=directory)
+    try:
+        with open(fd, mode, **kwargs) as f:
+            yield f
+
+        if st is None:
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(temp_filename, 0o666 & ~umask)
+        elif st.st_nlink > 1:
+            shutil.copyfile(temp_filename, output_filename)
+            os.unlink(temp_filename)
+            return
+        else:
+            os.chmod(temp_filename, stat.S_IMODE(st.st_mode))
+            try:
+                os.chown(temp_filename, st.st_uid, st.st_gid)
+            except OSError:
+                pass
+
+        os.replace(temp_filename, output_filename)
+    except BaseException:
+        os.unlink(temp_filename)
+        raise
+
+
+def is_regular_file(filename):
+    return stat.S_ISREG(os.stat(filename).st_mode)
+
+
+def map_file(input_filename):
+    """Maps a file read-only into memory and returns it as a bytes-like object.
+
+    The mapping is released when the returned object is garbage collected.
+    Files that cannot be mapped, such as pipes, are read into bytes instead."""
+    with open(input_filename, 'rb') as f:
+        if not stat.S_ISREG(os.fstat(f.fileno()).st_mode):
+            return f.read()
+
+        if f.seek(0, 2) == 0:
+            # Empty files cannot be mapped.
+            return b""
+
+        try:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            f.seek(0)
+            return f.read()
+
+
+@contextmanager
+def mapped_file(input_filename):
+    """Like map_file, but releases the mapping when leaving the context."""
+    buffer = map_file(input_filename)
+    try:
+        yield buffer
+    finally:
+        if isinstance(buffer, mmap.mmap):
+            buffer.close()